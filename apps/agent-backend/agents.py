@@ -0,0 +1,67 @@
+"""
+Agent identities hosted by this process.
+
+One backend can serve several agents; the client picks one per session in
+`init` ("agent_id", or "agent_did"). Each agent has its own DID, name, tool
+manifest and optionally its own system prompt, while HTTP pools, the LLM
+client and the MCP pool stay shared by every session in the process.
+
+AGENTS_CONFIG is a JSON list (inline, or a path to a JSON file) of
+{"id", "did", "name", "tools", "system_prompt"} objects; "tools" defaults
+to every tool. Without it the process hosts the single agent described
+by AGENT_DID / AGENT_NAME.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+
+class AgentProfile:
+    def __init__(self, agent_id: str, did: str, name: str, tools: List[str], system_prompt: Optional[str] = None):
+        self.agent_id = agent_id
+        self.did = did
+        self.name = name
+        self.tools = tools  # tool manifest: the most this agent may ever call
+        self.system_prompt = system_prompt
+
+    def allowed(self, permissions: Iterable[str]) -> List[str]:
+        """Permissions from the agent's VP, limited to its tool manifest"""
+        return [tool for tool in permissions if tool in self.tools]
+
+
+class AgentRegistry:
+    def __init__(self, profiles: List[AgentProfile]):
+        if not profiles:
+            raise ValueError("At least one agent must be configured")
+        self.profiles: Dict[str, AgentProfile] = {profile.agent_id: profile for profile in profiles}
+        self._by_did = {profile.did: profile for profile in profiles}
+        self.default = profiles[0]
+
+    def select(self, agent_id: Optional[str] = None, did: Optional[str] = None) -> Optional[AgentProfile]:
+        """The agent asked for in init; the default agent if none was named"""
+        if agent_id:
+            return self.profiles.get(agent_id)
+        if did:
+            return self._by_did.get(did)
+        return self.default
+
+
+def load_agents(all_tools: List[str], default_did: str, default_name: str) -> AgentRegistry:
+    """Build the registry from AGENTS_CONFIG, or the single default agent"""
+    config = os.getenv("AGENTS_CONFIG", "").strip()
+    if not config:
+        return AgentRegistry([AgentProfile("default", default_did, default_name, list(all_tools))])
+
+    if not config.startswith("["):
+        with open(config) as f:
+            config = f.read()
+
+    profiles = []
+    for entry in json.loads(config):
+        tools = entry.get("tools") or list(all_tools)
+        unknown = set(tools) - set(all_tools)
+        if unknown:
+            raise ValueError(f"Agent '{entry['id']}' lists unknown tools: {sorted(unknown)}")
+        profiles.append(AgentProfile(entry["id"], entry["did"], entry.get("name", entry["id"]), tools, entry.get("system_prompt")))
+    return AgentRegistry(profiles)
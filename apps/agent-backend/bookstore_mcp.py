@@ -0,0 +1,287 @@
+"""
+Persistent MCP client pool for the Bookstore MCP server.
+
+Each pooled connection is owned by a long-lived runner task that keeps the
+transport and ClientSession open, pings it periodically and reconnects with
+backoff when the server goes away. Tool calls borrow a ready connection
+instead of doing a transport + initialize handshake per call, and the
+server's tool list is fetched once and cached until a connection is
+re-established (the server may have been redeployed with other tools).
+
+Call timeouts are capped by the current turn's deadline, and tools that
+accept a deadline_ms argument are told how much of it is left.
+"""
+
+import asyncio
+import itertools
+import math
+from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import deadline
+import json_codec
+
+if TYPE_CHECKING:
+    from mcp import ClientSession
+
+
+class MCPUnavailableError(Exception):
+    """Raised when no healthy connection to the MCP server can be obtained."""
+
+
+class MCPToolError(Exception):
+    """Raised when the MCP server reports that a tool call failed."""
+
+
+class _PooledConnection:
+    """One persistent MCP session, kept alive by its own runner task.
+
+    The transport context managers are entered and exited inside the runner
+    task (anyio cancel scopes must not cross tasks); callers only ever use the
+    already-initialized ClientSession.
+    """
+
+    def __init__(self, pool: "BookstoreMCPPool", index: int):
+        self.pool = pool
+        self.index = index
+        self.session: Optional["ClientSession"] = None
+        self.ready = asyncio.Event()
+        self.broken = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run(), name=f"bookstore-mcp-{self.index}")
+
+    async def _open_transport(self, stack: AsyncExitStack):
+        # The mcp package is only imported once a pool starts (TOOL_EXECUTION_MODE=mcp)
+        if self.pool.transport == "streamable-http":
+            from mcp.client.streamable_http import streamablehttp_client
+            return await stack.enter_async_context(streamablehttp_client(self.pool.url))
+        from mcp.client.sse import sse_client
+        return await stack.enter_async_context(sse_client(self.pool.url))
+
+    async def _run(self):
+        backoff = self.pool.reconnect_min_delay
+        while True:
+            try:
+                async with AsyncExitStack() as stack:
+                    from mcp import ClientSession
+
+                    streams = await self._open_transport(stack)
+                    read_stream, write_stream = streams[0], streams[1]
+                    session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
+                    await asyncio.wait_for(session.initialize(), timeout=self.pool.connect_timeout)
+
+                    self.session = session
+                    self.pool.invalidate_tools()
+                    self.broken.clear()
+                    self.ready.set()
+                    backoff = self.pool.reconnect_min_delay
+                    print(f"[MCP] Connection #{self.index} established to {self.pool.url}")
+
+                    await self._watch(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[MCP] Connection #{self.index} error: {e}")
+            finally:
+                self.ready.clear()
+                self.session = None
+
+            print(f"[MCP] Connection #{self.index} reconnecting in {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.pool.reconnect_max_delay)
+
+    async def _watch(self, session: "ClientSession"):
+        """Health-check the session; return when it needs to be re-established."""
+        while True:
+            try:
+                await asyncio.wait_for(self.broken.wait(), timeout=self.pool.health_check_interval)
+                print(f"[MCP] Connection #{self.index} reported broken by a caller")
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await asyncio.wait_for(session.send_ping(), timeout=self.pool.health_check_timeout)
+            except Exception as e:
+                print(f"[MCP] Connection #{self.index} failed health check: {e}")
+                return
+
+
+class BookstoreMCPPool:
+    """Pool of persistent sessions to the Bookstore MCP server.
+
+    Sessions are shared by every AgentSession in the process. ClientSession
+    multiplexes concurrent requests over one transport, so a small pool is
+    enough; more connections only spread load across MCP server workers.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int = 2,
+        transport: str = "sse",
+        call_timeout: float = 10.0,
+        connect_timeout: float = 10.0,
+        health_check_interval: float = 30.0,
+        health_check_timeout: float = 5.0,
+        reconnect_min_delay: float = 0.5,
+        reconnect_max_delay: float = 30.0,
+    ):
+        self.url = url
+        self.size = max(1, size)
+        self.transport = transport
+        self.call_timeout = call_timeout
+        self.connect_timeout = connect_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+        self._connections: List[_PooledConnection] = []
+        self._round_robin = itertools.count()
+        self._tools: Optional[Dict[str, Any]] = None
+        self._tools_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def started(self) -> bool:
+        return bool(self._connections)
+
+    @property
+    def ready(self) -> bool:
+        """Whether a connection is up right now (no waiting for a reconnect)"""
+        return any(conn.ready.is_set() and conn.session is not None for conn in self._connections)
+
+    async def start(self):
+        """Open all pooled connections (idempotent)."""
+        if self.started:
+            return
+        self._tools_lock = asyncio.Lock()
+        self._connections = [_PooledConnection(self, i) for i in range(self.size)]
+        for conn in self._connections:
+            conn.start()
+
+    async def close(self):
+        """Cancel the runner tasks, closing every transport."""
+        tasks = [conn.task for conn in self._connections if conn.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._connections = []
+        self._tools = None
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "transport": self.transport,
+            "size": self.size,
+            "ready": sum(1 for conn in self._connections if conn.ready.is_set()),
+            "tools_cached": self._tools is not None,
+        }
+
+    async def _acquire(self, exclude: Optional[_PooledConnection] = None) -> _PooledConnection:
+        """Return a ready connection, waiting briefly for one to (re)connect."""
+        await self.start()
+
+        start = next(self._round_robin)
+        candidates = [
+            self._connections[(start + i) % len(self._connections)]
+            for i in range(len(self._connections))
+        ]
+        candidates = [conn for conn in candidates if conn is not exclude] or candidates
+        for conn in candidates:
+            if conn.ready.is_set() and conn.session is not None:
+                return conn
+
+        waiters = [asyncio.create_task(conn.ready.wait()) for conn in candidates]
+        try:
+            await asyncio.wait(
+                waiters, timeout=self.connect_timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        for conn in candidates:
+            if conn.ready.is_set() and conn.session is not None:
+                return conn
+        raise MCPUnavailableError(f"Bookstore MCP server unavailable at {self.url}")
+
+    def invalidate_tools(self):
+        """Forget the cached tool schemas; the next list_tools() fetches them again."""
+        self._tools = None
+
+    async def list_tools(self) -> Dict[str, Any]:
+        """Tool schemas exposed by the server, keyed by name (cached until a reconnect)."""
+        if self._tools is not None:
+            return self._tools
+        await self.start()
+        async with self._tools_lock:
+            if self._tools is None:
+                conn = await self._acquire()
+                result = await asyncio.wait_for(conn.session.list_tools(), timeout=self.call_timeout)
+                self._tools = {tool.name: tool for tool in result.tools}
+                print(f"[MCP] Cached {len(self._tools)} tool schema(s): {sorted(self._tools)}")
+        return self._tools
+
+    def _with_deadline(self, name: str, arguments: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Pass the remaining turn budget to tools that advertise deadline_ms"""
+        tool = (self._tools or {}).get(name)
+        if deadline.current() is None or tool is None:
+            return arguments
+        if "deadline_ms" not in (tool.inputSchema or {}).get("properties", {}):
+            return arguments
+        # Round up: the server reads deadline_ms=0 as "no deadline"
+        return {**arguments, "deadline_ms": max(1, math.ceil(timeout * 1000))}
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], idempotent: bool = True) -> Any:
+        """Call a tool on a pooled session and return its decoded payload.
+
+        A transport failure marks the connection broken; idempotent calls are
+        then retried once on another connection. Tool-level errors are never
+        retried.
+        """
+        timeout = deadline.timeout(self.call_timeout)
+        arguments = self._with_deadline(name, arguments, timeout)
+        conn = await self._acquire()
+        try:
+            result = await asyncio.wait_for(
+                conn.session.call_tool(name, arguments), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            conn.ready.clear()
+            conn.broken.set()
+            if not idempotent:
+                raise
+            print(f"[MCP] call_tool('{name}') failed on connection #{conn.index}: {e} — retrying")
+            conn = await self._acquire(exclude=conn)
+            result = await asyncio.wait_for(
+                conn.session.call_tool(name, arguments), timeout=deadline.timeout(self.call_timeout)
+            )
+        return _decode_result(result)
+
+
+def _decode_result(result) -> Any:
+    """Turn a CallToolResult into plain Python data."""
+    texts = [item.text for item in result.content if getattr(item, "type", None) == "text"]
+    if result.isError:
+        raise MCPToolError(" ".join(texts) or "MCP tool call failed")
+
+    structured = getattr(result, "structuredContent", None)
+    if structured is not None:
+        # FastMCP wraps non-object return values as {"result": ...}
+        if isinstance(structured, dict) and set(structured) == {"result"}:
+            return structured["result"]
+        return structured
+
+    values = []
+    for text in texts:
+        try:
+            values.append(json_codec.loads(text))
+        except ValueError:
+            values.append(text)
+    if len(values) == 1:
+        return values[0]
+    return values
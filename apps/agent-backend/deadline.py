@@ -0,0 +1,60 @@
+"""
+Per-turn deadlines.
+
+A chat turn runs inside deadline_scope(), which stores its Deadline in a
+context variable. Helpers on the turn's call path (LLM calls, VP
+verification, bookstore HTTP calls, MCP tool calls) call timeout(default)
+instead of using a fixed timeout, so every downstream wait shrinks to the
+time left in the turn. Outside a turn timeout() just returns the default.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """The turn's time budget is used up"""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("turn_deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current turn, or None outside a turn"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+
+def timeout(default: float) -> float:
+    """Timeout for one downstream call: default, capped by the turn budget"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("Turn deadline exceeded")
+    return min(default, left)
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Run the enclosed block (and tasks it spawns) under a deadline"""
+    deadline = Deadline(seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
@@ -0,0 +1,71 @@
+"""
+Fast path for the reply after a round of tool calls.
+
+A tool turn normally costs two LLM calls, and the second one mostly restates
+a deterministic result such as an order confirmation. When every tool in
+the round is listed in FAST_PATH_TOOLS the turn may skip it:
+
+- results that speak for themselves (a placed order, every item of a bulk
+  order placed, an order's status line) are answered from a template;
+- anything else (errors, partial bulk orders) is still summarised by the
+  LLM, on AZURE_SUMMARY_DEPLOYMENT when one is configured.
+
+FAST_PATH_AB_RATIO of eligible turns take the fast path and the rest keep
+the full LLM call as a control arm; fast_path_* metrics compare the two on
+latency and token spend.
+"""
+
+import os
+import random
+import re
+from typing import List, Optional, Tuple
+
+import metrics
+
+FAST_PATH_TOOLS = {
+    tool.strip()
+    for tool in os.getenv("FAST_PATH_TOOLS", "place_order,place_orders,check_order_status").split(",")
+    if tool.strip()
+}
+FAST_PATH_AB_RATIO = min(1.0, max(0.0, float(os.getenv("FAST_PATH_AB_RATIO", "1.0"))))
+
+# tool -> (pattern a self-explanatory result matches, reply template)
+TEMPLATES = {
+    "place_order": (re.compile(r"^Order placed successfully!"), "{result}"),
+    "place_orders": (re.compile(r"^Placed (\d+) of \1 orders:"), "All done! {result}"),
+    "check_order_status": (re.compile(r"^Order #\d+: "), "Here is the latest on your order:\n{result}"),
+}
+
+metrics.describe("fast_path_turns_total", "Tool turns eligible for the fast path, by A/B arm and how the reply was made")
+metrics.describe("fast_path_reply_seconds", "Time from the last tool result to the reply, by A/B arm")
+metrics.describe("fast_path_turn_seconds", "Duration of eligible tool turns, by A/B arm")
+metrics.describe("fast_path_llm_tokens_total", "LLM tokens spent on eligible tool turns, by A/B arm")
+
+
+def eligible(tool_names: List[str]) -> bool:
+    """Whether a round that called these tools may skip the full LLM reply"""
+    return bool(tool_names) and all(tool in FAST_PATH_TOOLS for tool in tool_names)
+
+
+def choose_arm() -> str:
+    """A/B assignment for an eligible turn: "fast_path" or "control" """
+    return "fast_path" if random.random() < FAST_PATH_AB_RATIO else "control"
+
+
+def template_reply(results: List[Tuple[str, str]]) -> Optional[str]:
+    """Reply for (tool, result) pairs, or None if any needs the LLM to explain"""
+    replies = []
+    for tool, result in results:
+        pattern, template = TEMPLATES.get(tool, (None, None))
+        if pattern is None or not pattern.match(result):
+            return None
+        replies.append(template.format(result=result))
+    return "\n\n".join(replies) or None
+
+
+def record(arm: str, method: str, reply_seconds: float, turn_seconds: float, tokens: int):
+    """Metrics for one eligible turn; method is template, summary or llm"""
+    metrics.inc("fast_path_turns_total", arm=arm, method=method)
+    metrics.observe("fast_path_reply_seconds", reply_seconds, arm=arm)
+    metrics.observe("fast_path_turn_seconds", turn_seconds, arm=arm)
+    metrics.inc("fast_path_llm_tokens_total", tokens, arm=arm)
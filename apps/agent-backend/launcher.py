@@ -0,0 +1,295 @@
+"""
+Production launcher: several agent-backend workers behind one port.
+
+    python launcher.py
+
+Starts AGENT_WORKERS uvicorn processes on 127.0.0.1 (AGENT_WORKER_BASE_PORT
+and up) and AGENT_PROXIES small TCP front proxies sharing AGENT_PORT through
+SO_REUSEPORT, so relaying bytes is spread over several cores instead of
+capping the deployment at one. Sessions live in each worker's memory, so
+every proxy sends every request for a session, i.e. /ws/chat/{session_id}
+and /sessions/{session_id}/..., to the worker chosen by a stable hash of
+the session id. Other requests are spread round-robin. Plain HTTP requests
+are forwarded with "Connection: close" so a keep-alive connection cannot
+carry a later request to the wrong worker. Platforms without SO_REUSEPORT
+get a single proxy, run by the launcher itself.
+
+Workers share one RESUME_TOKEN_SECRET (generated here unless set) so a
+resumption token stays valid whichever worker checks it. The LLM limits in
+LLM_BUDGETS are for the whole deployment: each worker's LLMScheduler gets
+its share, so N workers together still stay within LLM_MAX_CONCURRENCY and
+LLM_TOKENS_PER_MINUTE. /metrics reports the worker that happened to serve
+the scrape.
+
+SIGTERM / SIGINT drain: the launcher forwards SIGTERM once to every child.
+Children run in their own session, so a terminal's Ctrl-C reaches only the
+launcher; a second signal would make uvicorn skip the drain. The proxies
+stop accepting. Each worker (see DrainingServer in main.py) refuses new
+sessions and messages and lets running chat turns finish, for up to
+AGENT_GRACEFUL_SHUTDOWN_SECONDS, before uvicorn closes its sockets; open
+HTTP requests then get the same time again. Proxied connections stay up
+until their worker closes them. A worker or proxy that dies is restarted.
+"""
+
+import asyncio
+import itertools
+import os
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import zlib
+from typing import List, Optional
+
+AGENT_HOST = os.getenv("AGENT_HOST", "0.0.0.0")
+AGENT_PORT = int(os.getenv("AGENT_PORT", "8000"))
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", str(os.cpu_count() or 1)))
+AGENT_WORKER_BASE_PORT = int(os.getenv("AGENT_WORKER_BASE_PORT", "8100"))
+# Front proxy processes; 0 means one per four workers
+AGENT_PROXIES = int(os.getenv("AGENT_PROXIES", "0"))
+# uvicorn event loop: "auto" uses uvloop when it is installed
+AGENT_LOOP = os.getenv("AGENT_LOOP", "auto")
+AGENT_GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("AGENT_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+# Turn drain, then uvicorn's own graceful shutdown, then a little slack
+WORKER_STOP_SECONDS = 2 * AGENT_GRACEFUL_SHUTDOWN_SECONDS + 5
+
+# Deployment-wide LLM limits (with main.py's defaults) split across workers;
+# 0 tokens per minute means no budget and stays 0
+LLM_BUDGETS = {"LLM_MAX_CONCURRENCY": 8, "LLM_TOKENS_PER_MINUTE": 0, "LLM_MAX_QUEUE": 100}
+
+MAX_HEAD_BYTES = 64 * 1024
+_SESSION_PATH = re.compile(rb"^/(?:ws/chat|sessions)/([^/?#]+)")
+_CONNECTION_HEADER = re.compile(rb"^connection:", re.IGNORECASE)
+
+
+def _share(total: int, workers: int, index: int) -> int:
+    """Worker index's part of total when it is split as evenly as possible"""
+    return total // workers + (1 if index < total % workers else 0)
+
+
+def worker_budgets(workers: int, index: int) -> dict:
+    """Env overrides giving one worker its share of the LLM limits"""
+    budgets = {}
+    for name, default in LLM_BUDGETS.items():
+        total = int(os.getenv(name, str(default)))
+        budgets[name] = str(max(1, _share(total, workers, index)) if total else 0)
+    return budgets
+
+
+class Child:
+    """A supervised subprocess of the launcher.
+
+    Started in its own session: signals are forwarded once by the launcher,
+    never delivered a second time through the terminal's process group.
+    """
+
+    def __init__(self, name: str, args: List[str], env: dict):
+        self.name = name
+        self.args = args
+        self.env = env
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, *self.args],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=self.env,
+            start_new_session=True,
+        )
+        print(f"[LAUNCHER] {self.name} started (pid {self.process.pid})")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def terminate(self):
+        if self.alive():
+            self.process.send_signal(signal.SIGTERM)
+
+
+class Proxy:
+    """Routes connections on AGENT_PORT to the workers (one per process)"""
+
+    def __init__(self, ports: List[int]):
+        self.ports = ports
+        self._round_robin = itertools.cycle(range(len(ports)))
+        self._connections: set = set()
+
+    def _pick(self, path: bytes) -> int:
+        match = _SESSION_PATH.match(path)
+        if match:
+            # Same worker from every proxy process and across restarts, unlike hash()
+            return self.ports[zlib.crc32(match.group(1)) % len(self.ports)]
+        return self.ports[next(self._round_robin)]
+
+    @staticmethod
+    def _close_after_response(head: bytes) -> bytes:
+        """Force Connection: close on a plain HTTP request head"""
+        lines = head[:-4].split(b"\r\n")
+        lines = [lines[0]] + [line for line in lines[1:] if not _CONNECTION_HEADER.match(line)]
+        return b"\r\n".join(lines + [b"Connection: close"]) + b"\r\n\r\n"
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.write_eof()
+            except (OSError, RuntimeError):
+                pass
+
+    async def _handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        upstream_writer = None
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+            request_line = head.split(b"\r\n", 1)[0]
+            parts = request_line.split(b" ")
+            if len(parts) != 3:
+                return
+            if b"upgrade: websocket" not in head.lower():
+                head = self._close_after_response(head)
+
+            port = self._pick(parts[1])
+            upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", port)
+            upstream_writer.write(head)
+            await asyncio.gather(
+                self._pipe(client_reader, upstream_writer),
+                self._pipe(upstream_reader, client_writer),
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            for writer in (upstream_writer, client_writer):
+                if writer is not None:
+                    writer.close()
+            self._connections.discard(task)
+
+    async def start(self, reuse_port: bool) -> asyncio.AbstractServer:
+        return await asyncio.start_server(
+            self._handle, AGENT_HOST, AGENT_PORT, limit=MAX_HEAD_BYTES, reuse_port=reuse_port
+        )
+
+    async def finish(self, timeout: float):
+        """Let proxied connections end (their worker closes them), then cut the rest"""
+        if self._connections:
+            await asyncio.wait(set(self._connections), timeout=timeout)
+        for task in set(self._connections):
+            task.cancel()
+
+
+async def run_proxy():
+    """An extra proxy process (launcher.py --proxy), sharing AGENT_PORT with the launcher"""
+    proxy = Proxy([int(port) for port in os.environ["AGENT_PROXY_PORTS"].split(",")])
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    server = await proxy.start(reuse_port=True)
+    await stop.wait()
+    server.close()
+    await proxy.finish(WORKER_STOP_SECONDS)
+
+
+class Launcher:
+    def __init__(self, workers: int, proxies: int):
+        env = dict(os.environ)
+        # Every worker must accept every other worker's resumption tokens
+        env.setdefault("RESUME_TOKEN_SECRET", secrets.token_hex(32))
+        ports = [AGENT_WORKER_BASE_PORT + i for i in range(workers)]
+        self.workers: List[Child] = [
+            Child(
+                f"Worker #{i} on port {port}",
+                # main.py, not "uvicorn main:app": its server drains turns on SIGTERM
+                ["main.py"],
+                {
+                    **env,
+                    **worker_budgets(workers, i),
+                    "AGENT_HOST": "127.0.0.1",
+                    "AGENT_PORT": str(port),
+                    "AGENT_LOOP": AGENT_LOOP,
+                },
+            )
+            for i, port in enumerate(ports)
+        ]
+        if proxies > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            print("[LAUNCHER] SO_REUSEPORT is not available here — running a single proxy")
+            proxies = 1
+        # The launcher is proxy #0 itself
+        self.proxies: List[Child] = [
+            Child(f"Proxy #{i}", ["launcher.py", "--proxy"], {**env, "AGENT_PROXY_PORTS": ",".join(map(str, ports))})
+            for i in range(1, proxies)
+        ]
+        self.proxy = Proxy(ports)
+        concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", str(LLM_BUDGETS["LLM_MAX_CONCURRENCY"])))
+        if concurrency < workers:
+            print(f"[LAUNCHER] LLM_MAX_CONCURRENCY={concurrency} is below AGENT_WORKERS={workers}: "
+                  f"each worker still gets 1, so up to {workers} LLM calls may run at once")
+        self._draining = False
+
+    @property
+    def children(self) -> List[Child]:
+        return self.workers + self.proxies
+
+    async def _supervise(self):
+        """Restart workers and proxies that exit while we are not shutting down"""
+        while not self._draining:
+            for child in self.children:
+                if not child.alive() and not self._draining:
+                    code = child.process.returncode if child.process else None
+                    print(f"[LAUNCHER] {child.name} exited ({code}) — restarting")
+                    child.start()
+            await asyncio.sleep(1.0)
+
+    async def run(self):
+        for child in self.children:
+            child.start()
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = await self.proxy.start(reuse_port=bool(self.proxies))
+        print(f"[LAUNCHER] Routing {AGENT_HOST}:{AGENT_PORT} to {len(self.workers)} worker(s) "
+              f"through {len(self.proxies) + 1} proxy process(es), loop={AGENT_LOOP}")
+        supervisor = asyncio.create_task(self._supervise())
+
+        await stop.wait()
+        print(f"\n[LAUNCHER] Draining (turns get up to {AGENT_GRACEFUL_SHUTDOWN_SECONDS:.0f}s)...")
+        self._draining = True
+        supervisor.cancel()
+        server.close()  # stop accepting; open connections stay up until their worker closes them
+        for child in self.children:
+            child.terminate()  # once: workers drain their turns, proxies stop accepting
+
+        # Proxies wait WORKER_STOP_SECONDS for their connections; allow a little more
+        give_up_at = loop.time() + WORKER_STOP_SECONDS + 5
+        for child in self.children:
+            if child.process is None:
+                continue
+            try:
+                await loop.run_in_executor(None, child.process.wait, max(0.0, give_up_at - loop.time()))
+            except subprocess.TimeoutExpired:
+                print(f"[LAUNCHER] {child.name} did not stop in time — killing it")
+                child.process.kill()
+
+        await self.proxy.finish(5.0)
+        print("[LAUNCHER] Stopped")
+
+
+if __name__ == "__main__":
+    if "--proxy" in sys.argv[1:]:
+        asyncio.run(run_proxy())
+    else:
+        workers = max(1, AGENT_WORKERS)
+        asyncio.run(Launcher(workers, AGENT_PROXIES or max(1, workers // 4)).run())
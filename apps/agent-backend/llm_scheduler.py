@@ -0,0 +1,209 @@
+"""
+Admission control and fair scheduling for LLM calls.
+
+Every chat completion goes through one LLMScheduler per process:
+
+- at most max_concurrency calls are in flight;
+- a token bucket refilled at tokens_per_minute keeps the estimated token
+  spend under the deployment's TPM quota (the estimate is corrected with
+  the real usage once a call returns);
+- waiting calls are queued per user and served round-robin, so one busy
+  user cannot starve everybody else;
+- a 429 pauses all dispatching for the Retry-After the service asked for,
+  and the call is retried (with exponential backoff if no hint was given);
+- when the queues are full new calls are shed at once with LLMOverloaded
+  instead of piling up behind the rate limit.
+"""
+
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Optional
+
+import metrics
+
+metrics.describe("llm_queue_depth", "LLM calls waiting for admission")
+metrics.describe("llm_in_flight", "LLM calls currently running")
+metrics.describe("llm_queue_wait_seconds", "Time LLM calls waited for admission")
+metrics.describe("llm_requests_total", "LLM calls by outcome (ok, error, shed, rate_limited)")
+metrics.describe("llm_tokens_total", "Tokens reported by the LLM usage field")
+
+
+class LLMOverloaded(Exception):
+    """Raised instead of queueing when the scheduler is full"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the service asked us to wait, or None if exc is not a 429"""
+    if getattr(exc, "status_code", None) != 429:
+        return None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 0.0  # rate limited without a hint: caller backs off exponentially
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        tokens_per_minute: int = 0,
+        max_queue: int = 100,
+        max_queue_per_user: int = 3,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute  # 0 = no token budget
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()  # user -> waiters, in round-robin order
+        self._queued = 0
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        metrics.register_collector(self._collect)
+
+    def _collect(self):
+        metrics.set_gauge("llm_queue_depth", self._queued)
+        metrics.set_gauge("llm_in_flight", self._in_flight)
+
+    # -- token bucket -------------------------------------------------------
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        rate = self.tokens_per_minute / 60
+        self._tokens = min(float(self.tokens_per_minute), self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    def _token_wait(self, tokens: int) -> float:
+        """Seconds until tokens fit in the bucket (0 if they fit now)"""
+        if not self.tokens_per_minute:
+            return 0.0
+        # A call larger than the whole budget only waits for a full bucket
+        needed = min(tokens, self.tokens_per_minute) - self._tokens
+        return max(0.0, needed / (self.tokens_per_minute / 60))
+
+    # -- dispatching --------------------------------------------------------
+
+    def _dispatch(self):
+        """Admit waiting calls, round-robin over users, while capacity lasts"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        wait = self._paused_until - time.monotonic()
+        while wait <= 0 and self._queues and self._in_flight < self.max_concurrency:
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            wait = self._token_wait(waiter.tokens)
+            if wait > 0:
+                break
+            queue.popleft()
+            self._queued -= 1
+            self._queues.move_to_end(user)  # next user's turn
+            if not queue:
+                del self._queues[user]
+            if self.tokens_per_minute:
+                self._tokens -= waiter.tokens
+            self._in_flight += 1
+            waiter.future.set_result(None)
+        if wait > 0 and self._queues and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+
+    async def _acquire(self, user: str, tokens: int):
+        if self._queued >= self.max_queue or len(self._queues.get(user, ())) >= self.max_queue_per_user:
+            metrics.inc("llm_requests_total", outcome="shed")
+            retry_after = max(1.0, self._paused_until - time.monotonic())
+            raise LLMOverloaded("Too many requests are waiting for the language model", retry_after)
+
+        waiter = _Waiter(tokens)
+        self._queues.setdefault(user, deque()).append(waiter)
+        self._queued += 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # admitted just as the caller gave up
+            else:
+                queue = self._queues.get(user)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self._queued -= 1
+                    if not queue:
+                        del self._queues[user]
+            raise
+        finally:
+            metrics.observe("llm_queue_wait_seconds", time.monotonic() - waiter.enqueued_at)
+
+    def _release(self, estimated: int = 0, actual: Optional[int] = None):
+        self._in_flight -= 1
+        if self.tokens_per_minute and actual is not None:
+            self._tokens -= actual - estimated  # charge what the call really used
+        self._dispatch()
+
+    def _pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def run(
+        self,
+        user: str,
+        estimated_tokens: int,
+        call: Callable[[], Awaitable[Any]],
+        tokens_used: Callable[[Any], Optional[int]] = lambda result: None,
+    ) -> Any:
+        """Run call() once admitted for user, retrying on 429 responses.
+
+        estimated_tokens is charged against the TPM budget up front;
+        tokens_used(result) reports the real usage to correct it.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(user, estimated_tokens)
+            actual = None
+            try:
+                result = await call()
+                actual = tokens_used(result)
+            except Exception as exc:
+                retry_after = _retry_after(exc)
+                if retry_after is None or attempt == self.max_retries:
+                    metrics.inc("llm_requests_total", outcome="error")
+                    raise
+                metrics.inc("llm_requests_total", outcome="rate_limited")
+                delay = retry_after or self.backoff_base * 2 ** attempt * (1 + random.random() / 2)
+                print(f"[LLM] Rate limited — pausing admissions for {delay:.1f}s (attempt {attempt + 1})")
+                self._pause(delay)
+                continue
+            finally:
+                self._release(estimated_tokens, actual)
+
+            metrics.inc("llm_requests_total", outcome="ok")
+            if actual is not None:
+                metrics.inc("llm_tokens_total", actual)
+            return result
@@ -4,21 +4,37 @@ BookOrderer AI Agent - Backend Server (Azure OpenAI Version)
 FastAPI server with WebSocket for real-time chat interface
 """
 
+import asyncio
+import hmac
 import json
 import os
+import secrets
 import sys
-from typing import Optional, List, Dict, Any
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import time
+import uuid
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Set, Union
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from openai import AzureOpenAI
 import httpx
-from eth_account import Account
-from eth_account.messages import encode_defunct
-import nacl.signing
-import nacl.encoding
 from dotenv import load_dotenv
 
+import deadline
+import fast_path
+import json_codec
+import metrics
+import resume_tokens
+import turn_timings
+from agents import AgentProfile, load_agents
+from bookstore_mcp import BookstoreMCPPool, MCPToolError, MCPUnavailableError
+from json_stream import iter_json_array
+from llm_scheduler import LLMOverloaded, LLMScheduler
+from result_encoder import TableResult, estimate_tokens
+from resilience import Upstream
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -29,19 +45,152 @@ AZURE_ENDPOINT = os.getenv("AZURE_ENDPOINT")
 AZURE_API_VERSION = os.getenv("AZURE_API_VERSION", "2024-12-01-preview")
 AZURE_DEPLOYMENT = os.getenv("AZURE_DEPLOYMENT", "gpt-5.2-chat")
 AZURE_API_KEY = os.getenv("AZURE_API_KEY")
+# Optional faster deployment for fast-path tool turns whose results still
+# need summarising (see fast_path.py); unset keeps them on AZURE_DEPLOYMENT
+AZURE_SUMMARY_DEPLOYMENT = os.getenv("AZURE_SUMMARY_DEPLOYMENT")
+
+# Upper bound for a single LLM call (further capped by the turn deadline)
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# Overall budget for one chat turn: LLM calls, the wait for the UI's VPs,
+# verification and tool calls. Downstream timeouts shrink to what is left,
+# and the turn is cancelled once it runs out
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "120"))
+
+# Read-only tools may run speculatively while the user approves them (direct
+# HTTP mode only); the result is used only if the VP then verifies
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "true").lower() in ("1", "true", "yes")
+READ_ONLY_TOOLS = {"search_books", "view_inventory", "check_order_status"}
+
+# How long a stopping worker lets running chat turns (and then open HTTP
+# requests) finish after SIGTERM
+GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("AGENT_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+# Messages a client may queue while a turn is running
+MAX_QUEUED_MESSAGES = int(os.getenv("MAX_QUEUED_MESSAGES", "5"))
 
 # Booking App API
 BOOKING_API_URL = os.getenv("BOOKING_API_URL", "http://localhost:3000/api")
 HELIXID_BACKEND_URL = os.getenv("HELIXID_BACKEND_URL", "http://localhost:3005/api")
 
-# Agent Info (the agent this backend represents)
+# Tool execution mode: "http" calls the bookstore API directly, "mcp" routes
+# tool calls through the Bookstore MCP server over pooled, persistent sessions
+TOOL_EXECUTION_MODE = os.getenv("TOOL_EXECUTION_MODE", "http").lower()
+BOOKSTORE_MCP_URL = os.getenv("BOOKSTORE_MCP_URL", "http://localhost:8001/sse")
+# "sse" or "streamable-http" (must match the MCP server's MCP_TRANSPORT)
+BOOKSTORE_MCP_TRANSPORT = os.getenv("BOOKSTORE_MCP_TRANSPORT", "sse").lower()
+BOOKSTORE_MCP_POOL_SIZE = int(os.getenv("BOOKSTORE_MCP_POOL_SIZE", "2"))
+BOOKSTORE_MCP_HEALTH_INTERVAL = float(os.getenv("BOOKSTORE_MCP_HEALTH_INTERVAL", "30"))
+MCP_SCHEMA_TIMEOUT_SECONDS = float(os.getenv("MCP_SCHEMA_TIMEOUT_SECONDS", "2"))
+
+# Page size for list-style tools (inventory, search), so tool results and the
+# LLM context stay bounded however large the store gets
+BOOKSTORE_PAGE_SIZE = int(os.getenv("BOOKSTORE_PAGE_SIZE", "25"))
+BOOKSTORE_MAX_PAGE_SIZE = int(os.getenv("BOOKSTORE_MAX_PAGE_SIZE", "100"))
+
+# Approximate token budget for one tool result in the LLM context. List
+# results beyond it are summarised; the full result is kept per session and
+# served by /sessions/{session_id}/tool-results/{tool_call_id} to holders of
+# the session's results_token
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "800"))
+TOOL_RESULT_TOKEN_BUDGETS = {
+    "search_books": 400,
+    "view_inventory": TOOL_RESULT_TOKEN_BUDGET,
+    **json.loads(os.getenv("TOOL_RESULT_TOKEN_BUDGETS", "{}")),
+}
+MAX_STORED_TOOL_RESULTS = int(os.getenv("MAX_STORED_TOOL_RESULTS", "20"))
+
+# Bulk orders: item cap per place_orders call, and how many single-order
+# POSTs may run at once when the bookstore API has no bulk endpoint
+MAX_BULK_ORDER_ITEMS = int(os.getenv("MAX_BULK_ORDER_ITEMS", "50"))
+BULK_ORDER_CONCURRENCY = int(os.getenv("BULK_ORDER_CONCURRENCY", "4"))
+
+# Circuit breakers (one per upstream): open once at least BREAKER_MIN_CALLS of
+# the last BREAKER_WINDOW calls exist and BREAKER_FAILURE_RATE of them failed
+# or took longer than BREAKER_SLOW_CALL_SECONDS; probe again after
+# BREAKER_OPEN_SECONDS
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "3"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+# Hedged GETs (/books, /orders, /users/{did}): start a second attempt if the
+# first has not answered after this many ms. 0 disables hedging
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "0"))
+
+# LLM admission control: concurrent calls, tokens per minute (0 = no
+# budget; set it to the deployment's TPM quota), queue limits before calls
+# are shed, and retries on 429. The completion estimate is what a call is
+# charged up front until its real usage is known. The limits are per
+# process; launcher.py splits them across its workers
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+LLM_MAX_QUEUE_PER_USER = int(os.getenv("LLM_MAX_QUEUE_PER_USER", "3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "500"))
+
+# Agent Info (the default agent; AGENTS_CONFIG hosts several, see agents.py)
 AGENT_DID = os.getenv("AGENT_DID", "did:hedera:testnet:52vnnEG9pRG4Fy2Qn1yRNFhYvcY5PevKF1sM4NxN4YPh_0.0.7882614")
 AGENT_NAME = os.getenv("AGENT_NAME", "BookGenie AI")
 
+# Shared across all sessions in this process; connections are opened at startup
+bookstore_mcp = BookstoreMCPPool(
+    BOOKSTORE_MCP_URL,
+    size=BOOKSTORE_MCP_POOL_SIZE,
+    transport=BOOKSTORE_MCP_TRANSPORT,
+    health_check_interval=BOOKSTORE_MCP_HEALTH_INTERVAL,
+)
+
+def _cut_short_by_deadline(exc: BaseException) -> bool:
+    """A timeout that fired because the turn ran out, not because the upstream was slow.
+
+    deadline.timeout() caps a call's timeout to what is left of the turn, so
+    a capped call that times out does so with (next to) nothing left.
+    """
+    left = deadline.remaining()
+    return isinstance(exc, httpx.TimeoutException) and left is not None and left <= 0.05
+
+
+# Pooled HTTP clients + circuit breakers, shared by all sessions. Timeouts
+# shortened by one user's expiring turn are kept out of the breaker windows
+_upstream_options = dict(
+    is_neutral=_cut_short_by_deadline,
+    hedge_delay=HEDGE_DELAY_MS / 1000 or None,
+    window_size=BREAKER_WINDOW,
+    min_calls=BREAKER_MIN_CALLS,
+    failure_rate=BREAKER_FAILURE_RATE,
+    slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+    open_seconds=BREAKER_OPEN_SECONDS,
+)
+helixid_upstream = Upstream("helixid", **_upstream_options)
+bookstore_upstream = Upstream("bookstore", **_upstream_options)
+
+# Every chat completion in this process is admitted by this scheduler
+llm_scheduler = LLMScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_queue=LLM_MAX_QUEUE,
+    max_queue_per_user=LLM_MAX_QUEUE_PER_USER,
+    max_retries=LLM_MAX_RETRIES,
+)
+
 # -----------------------------
 # FastAPI setup
 # -----------------------------
-app = FastAPI(title="BookGenie AI Agent API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if TOOL_EXECUTION_MODE == "mcp":
+        print(f"[MCP] Tool execution via MCP server at {BOOKSTORE_MCP_URL} (pool size {BOOKSTORE_MCP_POOL_SIZE})")
+        await bookstore_mcp.start()
+    yield
+    await bookstore_mcp.close()
+    await helixid_upstream.aclose()
+    await bookstore_upstream.aclose()
+
+
+app = FastAPI(title="BookGenie AI Agent API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,40 +205,58 @@ app.add_middleware(
 # Authentication Functions
 # -----------------------------
 async def verify_agent_vp(vp: dict) -> dict:
-    """Verify agent's Verifiable Presentation (calls helixid-backend)"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{HELIXID_BACKEND_URL}/vps/verify",
-                json={"vp": vp},
-                timeout=5.0
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            print(f"VP verification error: {e}")
-            return {"valid": False, "error": str(e)}
-
-async def log_agent_activity(type: str, description: str, metadata: dict = None):
-    """Log agent activity to helixid-backend"""
-    async with httpx.AsyncClient() as client:
+    """Verify agent's Verifiable Presentation (calls helixid-backend)
+    
+    Fail-closed: an open circuit (helixid-backend unhealthy) is reported as
+    an invalid VP, just like a timeout would be.
+    """
+    try:
+        response = await helixid_upstream.request(
+            "POST",
+            f"{HELIXID_BACKEND_URL}/vps/verify",
+            json={"vp": vp},
+            timeout=deadline.timeout(5.0)
+        )
+        response.raise_for_status()
+        return json_codec.loads(response.content)
+    except Exception as e:
+        print(f"VP verification error: {e}")
+        return {"valid": False, "error": str(e)}
+
+def vp_holder(vp) -> Optional[str]:
+    """DID of a VP's holder (covered by the holder's proof that verify_agent_vp checks)"""
+    if isinstance(vp, str):
         try:
-            payload = {
-                "type": type,
-                "description": description,
-                "metadata": metadata or {}
-            }
-            # Add common metadata
-            payload["metadata"]["agent_did"] = AGENT_DID
-            payload["metadata"]["agent_name"] = AGENT_NAME
-            
-            await client.post(
-                f"{HELIXID_BACKEND_URL}/activity",
-                json=payload,
-                timeout=2.0
-            )
-        except Exception as e:
-            print(f"Failed to log activity: {str(e)}")
+            vp = json_codec.loads(vp)
+        except ValueError:
+            return None
+    if not isinstance(vp, dict):
+        return None
+    holder = vp.get("holder")
+    return holder.get("id") if isinstance(holder, dict) else holder
+
+
+async def log_agent_activity(type: str, description: str, metadata: dict = None, agent: Optional[AgentProfile] = None):
+    """Log agent activity to helixid-backend (as the default agent unless given)"""
+    try:
+        payload = {
+            "type": type,
+            "description": description,
+            "metadata": metadata or {}
+        }
+        # Add common metadata
+        agent = agent or agent_registry.default
+        payload["metadata"]["agent_did"] = agent.did
+        payload["metadata"]["agent_name"] = agent.name
+        
+        await helixid_upstream.request(
+            "POST",
+            f"{HELIXID_BACKEND_URL}/activity",
+            json=payload,
+            timeout=deadline.timeout(2.0)
+        )
+    except Exception as e:
+        print(f"Failed to log activity: {str(e)}")
 
 
 async def verify_user_signature(did: str, message: str, signature: str) -> dict:
@@ -102,20 +269,21 @@ async def verify_user_signature(did: str, message: str, signature: str) -> dict:
     Auto-detects which algorithm to use based on the public key format.
     """
     try:
-        # Fetch user's public key from helixid-backend
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{HELIXID_BACKEND_URL}/users/{did}",
-                timeout=5.0
-            )
-            if response.status_code != 200:
-                return {"valid": False, "error": "User not found"}
-            
-            user = response.json()
-            public_key = user.get("public_key")
-            
-            if not public_key:
-                return {"valid": False, "error": "No public key found for user"}
+        # Fetch user's public key from helixid-backend (idempotent GET, so hedged)
+        response = await helixid_upstream.request(
+            "GET",
+            f"{HELIXID_BACKEND_URL}/users/{did}",
+            hedge=True,
+            timeout=deadline.timeout(5.0)
+        )
+        if response.status_code != 200:
+            return {"valid": False, "error": "User not found"}
+        
+        user = json_codec.loads(response.content)
+        public_key = user.get("public_key")
+        
+        if not public_key:
+            return {"valid": False, "error": "No public key found for user"}
         
         # Determine signature algorithm based on public key format
         # Ed25519 public keys are 32 bytes (64 hex chars without 0x prefix)
@@ -124,6 +292,10 @@ async def verify_user_signature(did: str, message: str, signature: str) -> dict:
         if public_key.startswith('0x04'):
             # ECDSA verification (Ethereum)
             try:
+                # Imported on first ECDSA login: eth_account is slow to import
+                from eth_account import Account
+                from eth_account.messages import encode_defunct
+                
                 message_hash = encode_defunct(text=message)
                 recovered_address = Account.recover_message(message_hash, signature=signature)
                 expected_address = Account.from_key(public_key).address
@@ -143,6 +315,9 @@ async def verify_user_signature(did: str, message: str, signature: str) -> dict:
         
         else:
             # Ed25519 verification (Hedera)
+            import nacl.exceptions
+            import nacl.signing
+            
             try:
                 # Convert hex public key to bytes
                 if public_key.startswith('0x'):
@@ -191,6 +366,10 @@ async def verify_user_signature_with_key(did: str, message: str, signature: str,
         if public_key.startswith('0x04'):
             # ECDSA verification (Ethereum)
             try:
+                # Imported on first ECDSA login: eth_account is slow to import
+                from eth_account import Account
+                from eth_account.messages import encode_defunct
+                
                 message_hash = encode_defunct(text=message)
                 recovered_address = Account.recover_message(message_hash, signature=signature)
                 expected_address = Account.from_key(public_key).address
@@ -210,6 +389,9 @@ async def verify_user_signature_with_key(did: str, message: str, signature: str,
         
         else:
             # Ed25519 verification (Hedera)
+            import nacl.exceptions
+            import nacl.signing
+            
             try:
                 # Convert hex public key to bytes
                 if public_key.startswith('0x'):
@@ -250,86 +432,344 @@ async def verify_user_signature_with_key(did: str, message: str, signature: str,
 # -----------------------------
 # Bookstore Tools (Direct HTTP)
 # -----------------------------
-async def search_books_tool(query: str) -> str:
-    """Search for books by title or author"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BOOKING_API_URL}/books", timeout=5.0)
-            response.raise_for_status()
-            books = response.json()
-            
-            query = query.lower()
-            results = [
-                book for book in books 
-                if query in book["title"].lower() or query in book["author"].lower()
-            ]
-            
-            if not results:
-                return "No books found matching your query."
-            
-            return "\n".join([
-                f"ID: {b['id']} | Title: {b['title']} | Author: {b['author']} | Price: ${b['price']} | Stock: {b['stock']}"
-                for b in results
-            ])
-        except Exception as e:
-            return f"Error searching books: {str(e)}"
+def _book_filter(query: Optional[str] = None, author: Optional[str] = None, in_stock: Optional[bool] = None):
+    """Local equivalent of the /books query parameters"""
+    query = query.lower() if query else None
+    author = author.lower() if author else None
 
+    def matches(book: dict) -> bool:
+        if query and not (query in book["title"].lower() or query in book["author"].lower()):
+            return False
+        if author and author not in book["author"].lower():
+            return False
+        if in_stock is not None and (book["stock"] > 0) != in_stock:
+            return False
+        return True
 
-async def view_inventory_tool() -> str:
-    """View the full inventory of books"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BOOKING_API_URL}/books", timeout=5.0)
+    return matches
+
+
+async def fetch_bookstore_page(
+    path: str,
+    filters: dict,
+    matches,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    max_matches: Optional[int] = None,
+):
+    """Fetch one page of a bookstore list endpoint as (items, next_cursor).
+
+    Filters and paging are pushed down as query parameters. A bookstore API
+    that applies them says so with X-Query-Applied; otherwise it is sending
+    the full array, which is parsed incrementally and filtered locally. The
+    stream is dropped as soon as the page is complete (or after max_matches
+    hits for lookups that can only match that many), so memory stays bounded
+    whatever the size of the upstream array.
+    """
+    limit = min(limit or BOOKSTORE_PAGE_SIZE, BOOKSTORE_MAX_PAGE_SIZE)
+    offset = int(cursor) if cursor else 0
+
+    params = {
+        key: (str(value).lower() if isinstance(value, bool) else value)
+        for key, value in filters.items() if value is not None
+    }
+    params["limit"] = limit
+    if offset:
+        params["cursor"] = offset
+
+    async def read_page(client: httpx.AsyncClient):
+        async with client.stream("GET", f"{BOOKING_API_URL}{path}", params=params, timeout=deadline.timeout(5.0)) as response:
             response.raise_for_status()
-            books = response.json()
-            
-            if not books:
-                return "Inventory is empty."
-            
-            return "\n".join([
-                f"ID: {b['id']} | Title: {b['title']} | Author: {b['author']} | Price: ${b['price']} | Stock: {b['stock']}"
-                for b in books
-            ])
-        except Exception as e:
-            return f"Error fetching inventory: {str(e)}"
+
+            if response.headers.get("x-query-applied"):
+                await response.aread()
+                return json_codec.loads(response.content), response.headers.get("x-next-cursor") or None
+
+            page = []
+            matched = 0
+            async for item in iter_json_array(response.aiter_bytes()):
+                if not matches(item):
+                    continue
+                if matched >= offset + limit:
+                    return page, str(offset + limit)
+                if matched >= offset:
+                    page.append(item)
+                matched += 1
+                if max_matches is not None and matched >= max_matches:
+                    break
+            return page, None
+
+    # Read-only, so a slow first attempt may be hedged
+    return await bookstore_upstream.run(read_page, hedge=True)
+
+
+BOOK_COLUMNS = ("id", "title", "author", "price", "stock")
+
+
+def _book_table(books: list, empty_message: str, cursor: Optional[str] = None, next_cursor: Optional[str] = None) -> TableResult:
+    return TableResult(
+        BOOK_COLUMNS,
+        books,
+        empty_message,
+        offset=int(cursor) if cursor else 0,
+        next_cursor=next_cursor,
+    )
+
+
+def _format_order(order: dict) -> str:
+    return f"Order #{order['order_id']}: {order['quantity']} x '{order['book_title']}' - Total: ${order['total_price']} (Status: {order['status']})"
+
+
+async def search_books_tool(query: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> Union[TableResult, str]:
+    """Search for books by title or author"""
+    try:
+        results, next_cursor = await fetch_bookstore_page(
+            "/books", {"q": query}, _book_filter(query=query), limit, cursor
+        )
+        return _book_table(results, "No books found matching your query.", cursor, next_cursor)
+    except Exception as e:
+        return f"Error searching books: {str(e)}"
 
 
-async def place_order_tool(book_id: str, quantity: int = 1) -> str:
+async def view_inventory_tool(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    author: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+) -> Union[TableResult, str]:
+    """View the inventory of books, one page at a time"""
+    try:
+        books, next_cursor = await fetch_bookstore_page(
+            "/books",
+            {"author": author, "in_stock": in_stock},
+            _book_filter(author=author, in_stock=in_stock),
+            limit,
+            cursor,
+        )
+        empty_message = "No books match those filters." if (author or in_stock is not None) else "Inventory is empty."
+        return _book_table(books, empty_message, cursor, next_cursor)
+    except Exception as e:
+        return f"Error fetching inventory: {str(e)}"
+
+
+async def place_order_tool(book_id: str, quantity: int = 1, idempotency_key: Optional[str] = None) -> str:
     """Place an order for a book"""
-    async with httpx.AsyncClient() as client:
+    try:
+        payload = {"book_id": book_id, "quantity": quantity, "ordered_by": 'agent'}
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        response = await bookstore_upstream.request("POST", f"{BOOKING_API_URL}/orders", json=payload, headers=headers, timeout=deadline.timeout(5.0))
+        
+        if response.status_code in (200, 201):  # 200: already placed by an earlier attempt with this key
+            order = json_codec.loads(response.content)  # API returns the order object directly (no wrapper)
+            return f"Order placed successfully! Order ID: #{order['order_id']}. You ordered {quantity} copy/copies of '{order['book_title']}' for ${order['total_price']}."
+        else:
+            try:
+                error_msg = json_codec.loads(response.content).get('error', 'Unknown error')
+            except:
+                error_msg = response.text
+            return f"Failed to place order: {error_msg}"
+    except Exception as e:
+        return f"Error placing order: {str(e)}"
+
+
+def _format_order_results(results: list) -> str:
+    """Summarise per-item results of a bulk order"""
+    lines = []
+    for r in results:
+        if r["status"] in ("created", "duplicate"):
+            order = r["order"]
+            note = " (already placed)" if r["status"] == "duplicate" else ""
+            lines.append(f"Book {r['book_id']}: Order #{order['order_id']} — {order['quantity']} x '{order['book_title']}' for ${order['total_price']}{note}")
+        else:
+            lines.append(f"Book {r['book_id']}: FAILED — {r.get('error', 'Unknown error')}")
+    placed = sum(1 for r in results if r["status"] != "error")
+    return f"Placed {placed} of {len(results)} orders:\n" + "\n".join(lines)
+
+
+async def _place_single_order(item: dict) -> dict:
+    """One POST /orders for a bulk item (fallback when there is no bulk endpoint)"""
+    try:
+        response = await bookstore_upstream.request(
+            "POST",
+            f"{BOOKING_API_URL}/orders",
+            json={"book_id": item["book_id"], "quantity": item["quantity"], "ordered_by": "agent"},
+            headers={"Idempotency-Key": item["idempotency_key"]},
+            timeout=deadline.timeout(5.0),
+        )
+        if response.status_code in (200, 201):
+            status = "created" if response.status_code == 201 else "duplicate"
+            return {"book_id": item["book_id"], "status": status, "order": json_codec.loads(response.content)}
         try:
-            payload = {"book_id": book_id, "quantity": quantity, "ordered_by": 'agent'}
-            response = await client.post(f"{BOOKING_API_URL}/orders", json=payload, timeout=5.0)
-            
-            if response.status_code == 201:
-                order = response.json()  # API returns the order object directly (no wrapper)
-                return f"Order placed successfully! Order ID: #{order['order_id']}. You ordered {quantity} copy/copies of '{order['book_title']}' for ${order['total_price']}."
-            else:
-                try:
-                    error_msg = response.json().get('error', 'Unknown error')
-                except:
-                    error_msg = response.text
-                return f"Failed to place order: {error_msg}"
-        except Exception as e:
-            return f"Error placing order: {str(e)}"
+            error_msg = json_codec.loads(response.content).get("error", "Unknown error")
+        except Exception:
+            error_msg = response.text
+        return {"book_id": item["book_id"], "status": "error", "error": error_msg}
+    except Exception as e:
+        return {"book_id": item["book_id"], "status": "error", "error": str(e)}
+
+
+async def place_orders_tool(items: list, idempotency_key: str) -> str:
+    """Place orders for several books at once
+
+    Items are sent in a single POST /orders/bulk when the bookstore supports
+    it, otherwise as individual orders with bounded concurrency. Item i is
+    tagged with "<idempotency_key>:<i>" so a retried call never orders twice.
+    """
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ORDER_ITEMS:
+        return f"Failed to place orders: provide between 1 and {MAX_BULK_ORDER_ITEMS} items."
+
+    try:
+        payload = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or "book_id" not in item:
+                return f"Failed to place orders: item {i + 1} has no book_id."
+            quantity = item.get("quantity", 1)
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                return f"Failed to place orders: item {i + 1} needs a whole-number quantity of at least 1."
+            payload.append({
+                "book_id": str(item["book_id"]),
+                "quantity": quantity,
+                "idempotency_key": f"{idempotency_key}:{i}",
+            })
+
+        response = await bookstore_upstream.request(
+            "POST",
+            f"{BOOKING_API_URL}/orders/bulk",
+            json={"items": payload, "ordered_by": "agent"},
+            timeout=deadline.timeout(10.0),
+        )
+        if response.status_code not in (404, 405):
+            response.raise_for_status()
+            return _format_order_results(json_codec.loads(response.content)["results"])
+
+        # No bulk endpoint: fall back to one order per item, a few at a time
+        semaphore = asyncio.Semaphore(BULK_ORDER_CONCURRENCY)
+
+        async def submit(item: dict) -> dict:
+            async with semaphore:
+                return await _place_single_order(item)
+
+        results = await asyncio.gather(*(submit(item) for item in payload))
+        return _format_order_results(list(results))
+    except Exception as e:
+        return f"Error placing orders: {str(e)}"
 
 
 async def check_order_status_tool(order_id: int) -> str:
     """Check the status of an order"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{BOOKING_API_URL}/orders", timeout=5.0)
-            response.raise_for_status()
-            orders = response.json()
-            
-            order = next((o for o in orders if int(o["order_id"]) == int(order_id)), None)
-            
-            if not order:
+    try:
+        orders, _ = await fetch_bookstore_page(
+            "/orders",
+            {"order_id": order_id},
+            lambda o: int(o["order_id"]) == int(order_id),
+            limit=1,
+            max_matches=1,
+        )
+        
+        if not orders:
+            return f"Order #{order_id} not found."
+        
+        return _format_order(orders[0])
+    except Exception as e:
+        return f"Error checking order status: {str(e)}"
+
+
+# -----------------------------
+# Bookstore Tools (MCP client)
+# -----------------------------
+# Agent tool -> Bookstore MCP server tool that backs it
+MCP_TOOL_MAP = {
+    "search_books": "list_books",
+    "view_inventory": "list_books",
+    "place_order": "place_order",
+    "place_orders": "place_orders",
+    "check_order_status": "get_orders",
+}
+
+
+def _vp_token(vp) -> str:
+    """MCP tools take the VP as a string argument"""
+    return vp if isinstance(vp, str) else json_codec.dumps(vp)
+
+
+async def execute_mcp_tool(tool_name: str, tool_args: dict, vp, idempotency_key: Optional[str] = None) -> Union[TableResult, str]:
+    """Execute a bookstore tool through the pooled Bookstore MCP session"""
+    mcp_tool = MCP_TOOL_MAP.get(tool_name)
+    if not mcp_tool:
+        return f"Unknown tool: {tool_name}"
+
+    try:
+        available = await bookstore_mcp.list_tools()
+        if mcp_tool not in available:
+            return f"Tool '{tool_name}' is not available on the bookstore MCP server"
+
+        vp_token = _vp_token(vp)
+        if tool_name == "search_books":
+            page = await bookstore_mcp.call_tool(mcp_tool, {
+                "vp_token": vp_token,
+                "query": tool_args["query"],
+                "limit": tool_args.get("limit") or BOOKSTORE_PAGE_SIZE,
+                "cursor": tool_args.get("cursor"),
+            })
+            return _book_table(page["items"], "No books found matching your query.", tool_args.get("cursor"), page.get("next_cursor"))
+
+        elif tool_name == "view_inventory":
+            page = await bookstore_mcp.call_tool(mcp_tool, {
+                "vp_token": vp_token,
+                "limit": tool_args.get("limit") or BOOKSTORE_PAGE_SIZE,
+                "cursor": tool_args.get("cursor"),
+                "author": tool_args.get("author"),
+                "in_stock": tool_args.get("in_stock"),
+            })
+            empty_message = "No books match those filters." if (tool_args.get("author") or tool_args.get("in_stock") is not None) else "Inventory is empty."
+            return _book_table(page["items"], empty_message, tool_args.get("cursor"), page.get("next_cursor"))
+
+        elif tool_name == "place_order":
+            quantity = tool_args.get("quantity", 1)
+            order = await bookstore_mcp.call_tool(
+                mcp_tool,
+                {
+                    "vp_token": vp_token,
+                    "book_id": str(tool_args["book_id"]),
+                    "quantity": quantity,
+                    "idempotency_key": idempotency_key,
+                },
+                idempotent=idempotency_key is not None,
+            )
+            return f"Order placed successfully! Order ID: #{order['order_id']}. You ordered {quantity} copy/copies of '{order['book_title']}' for ${order['total_price']}."
+
+        elif tool_name == "place_orders":
+            response = await bookstore_mcp.call_tool(
+                mcp_tool,
+                {
+                    "vp_token": vp_token,
+                    "items": [
+                        {"book_id": str(item["book_id"]), "quantity": item.get("quantity", 1)}
+                        for item in tool_args["items"]
+                    ],
+                    "idempotency_key": idempotency_key,
+                },
+                idempotent=idempotency_key is not None,
+            )
+            return _format_order_results(response["results"])
+
+        elif tool_name == "check_order_status":
+            order_id = tool_args["order_id"]
+            page = await bookstore_mcp.call_tool(mcp_tool, {
+                "vp_token": vp_token,
+                "order_id": int(order_id),
+                "limit": 1,
+            })
+            if not page["items"]:
                 return f"Order #{order_id} not found."
-            
-            return f"Order #{order_id}: {order['quantity']} x '{order['book_title']}' - Total: ${order['total_price']} (Status: {order['status']})"
-        except Exception as e:
-            return f"Error checking order status: {str(e)}"
+            return _format_order(page["items"][0])
+
+    except MCPToolError as e:
+        return f"Bookstore MCP tool '{mcp_tool}' failed: {str(e)}"
+    except MCPUnavailableError as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        return f"Error calling bookstore MCP server: {str(e)}"
 
 
 # Tool definitions for Azure OpenAI
@@ -345,6 +785,14 @@ BOOKSTORE_TOOLS = [
                     "query": {
                         "type": "string",
                         "description": "The search query string"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of results to return"
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "Cursor from a previous result to fetch the next page"
                     }
                 },
                 "required": ["query"]
@@ -355,10 +803,27 @@ BOOKSTORE_TOOLS = [
         "type": "function",
         "function": {
             "name": "view_inventory",
-            "description": "View the full inventory of books with stock details",
+            "description": "View the inventory of books with stock details, one page at a time",
             "parameters": {
                 "type": "object",
-                "properties": {}
+                "properties": {
+                    "limit": {
+                        "type": "integer",
+                        "description": "Maximum number of books to return"
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "Cursor from a previous result to fetch the next page"
+                    },
+                    "author": {
+                        "type": "string",
+                        "description": "Only books whose author contains this text"
+                    },
+                    "in_stock": {
+                        "type": "boolean",
+                        "description": "true for books in stock, false for sold-out books"
+                    }
+                }
             }
         }
     },
@@ -384,6 +849,38 @@ BOOKSTORE_TOOLS = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "place_orders",
+            "description": "Place orders for several books at once (use instead of repeated place_order calls)",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "description": "The books to order",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "book_id": {
+                                    "type": "string",
+                                    "description": "The ID of the book to order"
+                                },
+                                "quantity": {
+                                    "type": "integer",
+                                    "description": "The number of copies to order (default is 1)",
+                                    "default": 1
+                                }
+                            },
+                            "required": ["book_id"]
+                        }
+                    }
+                },
+                "required": ["items"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -403,44 +900,194 @@ BOOKSTORE_TOOLS = [
     }
 ]
 
+# Schema keywords whose values are data, not subschemas
+_SCHEMA_LITERALS = {"default", "enum", "const", "examples"}
+
+
+def _inline_refs(node, defs: dict):
+    """Copy of a JSON schema with local "#/$defs/..." references resolved.
+
+    Drops the pydantic-generated "title" annotations; a property that is
+    itself named "title" is kept.
+    """
+    if isinstance(node, list):
+        return [_inline_refs(item, defs) for item in node]
+    if not isinstance(node, dict):
+        return node
+    ref = node.get("$ref", "")
+    if ref.startswith("#/$defs/") and ref[len("#/$defs/"):] in defs:
+        return _inline_refs(defs[ref[len("#/$defs/"):]], defs)
+    schema = {}
+    for key, value in node.items():
+        if key == "title":
+            continue
+        if key in _SCHEMA_LITERALS:
+            schema[key] = value
+        elif key in ("properties", "patternProperties") and isinstance(value, dict):
+            schema[key] = {name: _inline_refs(prop, defs) for name, prop in value.items()}
+        else:
+            schema[key] = _inline_refs(value, defs)
+    return schema
+
+
+def mcp_tool_definitions(schemas: Dict[str, Any]) -> List[dict]:
+    """BOOKSTORE_TOOLS rebuilt from the MCP server's cached tool schemas.
+
+    Several agent tools share one server tool (MCP_TOOL_MAP), so names and
+    descriptions stay ours; each parameter's schema comes from the server,
+    and tools or parameters the server no longer offers are left out.
+    Server-side arguments (vp_token, idempotency_key, deadline_ms) are
+    never exposed to the LLM.
+    """
+    definitions = []
+    for tool in BOOKSTORE_TOOLS:
+        function = tool["function"]
+        schema = schemas.get(MCP_TOOL_MAP.get(function["name"], ""))
+        if schema is None:
+            continue
+        input_schema = schema.inputSchema or {}
+        server_properties = input_schema.get("properties", {})
+        defs = input_schema.get("$defs", {})
+        properties = {}
+        for name, ours in function["parameters"]["properties"].items():
+            if name not in server_properties:
+                continue
+            prop = _inline_refs(server_properties[name], defs)
+            prop.setdefault("description", ours.get("description", ""))
+            properties[name] = prop
+        definitions.append({
+            "type": "function",
+            "function": {
+                "name": function["name"],
+                "description": function["description"],
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": [name for name in function["parameters"].get("required", []) if name in properties],
+                },
+            },
+        })
+    return definitions
+
+
+_mcp_definitions: tuple = (None, BOOKSTORE_TOOLS)  # (schemas they were built from, definitions)
+
+
+async def llm_tool_definitions() -> List[dict]:
+    """Tool definitions offered to the LLM.
+
+    In MCP mode they follow the server's cached schemas (rebuilt whenever
+    the pool refetches them); otherwise, or while the server is
+    unreachable, the static BOOKSTORE_TOOLS. The turn never waits for a
+    reconnect here, and a fetch gets at most MCP_SCHEMA_TIMEOUT_SECONDS.
+    """
+    global _mcp_definitions
+    if TOOL_EXECUTION_MODE != "mcp":
+        return BOOKSTORE_TOOLS
+    if not bookstore_mcp.ready:
+        return BOOKSTORE_TOOLS
+    try:
+        schemas = await asyncio.wait_for(
+            bookstore_mcp.list_tools(), timeout=deadline.timeout(MCP_SCHEMA_TIMEOUT_SECONDS)
+        )
+    except (MCPUnavailableError, asyncio.TimeoutError) as e:
+        print(f"[MCP] Tool schemas unavailable ({e}) — using the built-in definitions")
+        return BOOKSTORE_TOOLS
+    if _mcp_definitions[0] is not schemas:
+        _mcp_definitions = (schemas, mcp_tool_definitions(schemas))
+    return _mcp_definitions[1]
+
+
+# Agent identities hosted by this process, each with its own tool manifest
+agent_registry = load_agents([tool["function"]["name"] for tool in BOOKSTORE_TOOLS], AGENT_DID, AGENT_NAME)
+
 
 # -----------------------------
 # Agent Session with Azure OpenAI
 # -----------------------------
-class AgentSession:
-    """Manages agent conversation with Azure OpenAI"""
-    
-    def __init__(self, api_key: str, session_id: str):
-        self.client = AzureOpenAI(
+metrics.describe("tool_prefetch_total", "Speculative read-only tool runs, by whether the result was used")
+
+
+metrics.describe("agent_sessions", "Sessions held in memory per hosted agent")
+metrics.describe("agent_turns_total", "Chat turns per hosted agent, by outcome")
+metrics.describe("agent_tool_calls_total", "Tool executions per hosted agent")
+metrics.describe("agent_llm_tokens_total", "LLM tokens used per hosted agent")
+
+DEFAULT_SYSTEM_PROMPT = """You are BookOrderer, an AI agent that helps users order books from a bookstore.
+
+You can:
+- Search for books by title or author
+- View the full inventory
+- Place orders for books (use place_orders when ordering several books at once)
+- Check order status
+
+Always confirm with the user before placing an order. Be friendly and helpful."""
+
+# One client (and connection pool) per API key, shared by every session and agent
+_llm_clients: Dict[str, Any] = {}
+
+
+def llm_client(api_key: str):
+    """Azure OpenAI client (openai is imported on first use to keep start-up fast)"""
+    client = _llm_clients.get(api_key)
+    if client is None:
+        from openai import AsyncAzureOpenAI
+        client = _llm_clients[api_key] = AsyncAzureOpenAI(
             api_version=AZURE_API_VERSION,
             azure_endpoint=AZURE_ENDPOINT,
             api_key=api_key,
+            # The LLMScheduler retries 429s and timeouts itself (Retry-After
+            # pause, TPM accounting, shedding, turn deadline); SDK retries
+            # would bypass all of that while holding a scheduler slot
+            max_retries=0,
         )
+    return client
+
+
+def _discard_prefetch(tool_name: str, prefetched: Optional[asyncio.Task]):
+    """Drop a speculative result whose VP did not verify"""
+    if prefetched is None:
+        return
+    prefetched.cancel()
+    metrics.inc("tool_prefetch_total", tool=tool_name, outcome="discarded")
+
+
+class AgentSession:
+    """Manages agent conversation with Azure OpenAI"""
+    
+    def __init__(self, api_key: str, session_id: str, profile: Optional[AgentProfile] = None):
+        self.api_key = api_key
         self.session_id = session_id
+        self.profile = profile or agent_registry.default  # which hosted agent this session talks to
         self.conversation_history: List[Dict] = []
         self.permissions: List[str] = []  # Agent permissions from VC
         self.user_id: Optional[str] = None  # Authenticated user ID
         self.user_did: Optional[str] = None  # Authenticated user DID
+        self.tool_results: "OrderedDict[str, str]" = OrderedDict()  # tool_call_id -> full result (kept out of the prompt)
+        self.results_token = secrets.token_urlsafe(32)  # bearer credential for those results, sent on `connected`
+        self.timings_enabled = False  # add a latency breakdown to response frames (set in init)
+        self.websocket: Optional[WebSocket] = None  # connection currently attached to this session
+        self.connection: Optional["ChatConnection"] = None  # its chat loop, once running
+        self.detached_at: Optional[float] = None  # monotonic time of the last disconnect
+        self.resume_nonce: Optional[str] = None  # nonce of the one resumption token that is valid
+        self.llm_tokens_used = 0  # running total, for per-turn token spend
+    
+    @property
+    def client(self):
+        return llm_client(self.api_key)
     
-    async def get_llm_response(self, user_message=None, allow_tools=True):
+    async def get_llm_response(self, user_message=None, allow_tools=True, deployment: Optional[str] = None):
         """Get response from Azure OpenAI, handling conversation history.
         When allow_tools=False (e.g. after a round of tool execution), force a final
-        text-only response so we don't loop another tool_auth_request."""
+        text-only response so we don't loop another tool_auth_request.
+        deployment overrides AZURE_DEPLOYMENT for this call."""
         if user_message:
             self.conversation_history.append({
                 "role": "user",
                 "content": user_message
             })
         
-        system_prompt = """You are BookOrderer, an AI agent that helps users order books from a bookstore.
-
-You can:
-- Search for books by title or author
-- View the full inventory
-- Place orders for books
-- Check order status
-
-Always confirm with the user before placing an order. Be friendly and helpful."""
+        system_prompt = self.profile.system_prompt or DEFAULT_SYSTEM_PROMPT
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -452,29 +1099,138 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
             allowed_tools = []
             tool_choice = "none"
         else:
+            allowed = self.permissions or self.profile.tools
             allowed_tools = [
-                tool for tool in BOOKSTORE_TOOLS
-                if tool["function"]["name"] in self.permissions
+                tool for tool in await llm_tool_definitions()
+                if tool["function"]["name"] in allowed
             ]
-            if not self.permissions:
-                allowed_tools = BOOKSTORE_TOOLS
             tool_choice = "auto" if allowed_tools else "none"
             
-        print(f"[LLM] get_llm_response(allow_tools={allow_tools}) — tools={len(allowed_tools)}, tool_choice={tool_choice}")
-        response = self.client.chat.completions.create(
-            model=AZURE_DEPLOYMENT,
-            messages=messages,
-            tools=allowed_tools,
-            tool_choice=tool_choice,
-            max_completion_tokens=4096
-        )
+        model = deployment or AZURE_DEPLOYMENT
+        print(f"[LLM] get_llm_response(allow_tools={allow_tools}) — model={model}, tools={len(allowed_tools)}, tool_choice={tool_choice}")
+        # Admitted by the shared scheduler: fair per user, within the TPM budget
+        prompt_tokens = estimate_tokens("".join(str(m.get("content") or "") for m in messages))
+        with turn_timings.measure("llm", allow_tools=allow_tools, model=model) as timing:
+            response = await llm_scheduler.run(
+                self.user_did or self.session_id,
+                prompt_tokens + LLM_EXPECTED_COMPLETION_TOKENS,
+                lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=allowed_tools,
+                    tool_choice=tool_choice,
+                    max_completion_tokens=4096,
+                    timeout=deadline.timeout(LLM_TIMEOUT_SECONDS)
+                ),
+                tokens_used=lambda response: response.usage.total_tokens if response.usage else None
+            )
+            if response.usage:
+                self.llm_tokens_used += response.usage.total_tokens
+                metrics.inc("agent_llm_tokens_total", response.usage.total_tokens, agent=self.profile.agent_id)
+            if timing is not None and response.usage:
+                timing["tokens"] = {
+                    "prompt": response.usage.prompt_tokens,
+                    "completion": response.usage.completion_tokens,
+                    "total": response.usage.total_tokens,
+                }
         
         msg = response.choices[0].message
         if not allow_tools and getattr(msg, "tool_calls", None):
             print(f"[LLM] API returned {len(msg.tool_calls)} tool_calls despite tool_choice=none (chat loop will break after one round)")
         return msg
 
-    async def execute_tool(self, tool_name, tool_args, vp = None):
+    def encode_tool_result(self, tool_call_id: str, tool_name: str, result: Union[TableResult, str]) -> str:
+        """Render a tool result for the conversation history.
+
+        List results are encoded compactly within the tool's token budget;
+        the full rendering is kept (for the last MAX_STORED_TOOL_RESULTS
+        calls) so it can be fetched without going through the prompt.
+        """
+        if isinstance(result, TableResult):
+            budget = TOOL_RESULT_TOKEN_BUDGETS.get(tool_name, TOOL_RESULT_TOKEN_BUDGET)
+            content, truncated = result.encode(budget)
+            full = result.render_full()
+            if truncated:
+                print(f"[TOOL] '{tool_name}' result truncated to ~{budget} tokens ({len(result.rows)} rows, {len(full)} chars in full)")
+        else:
+            content = full = result
+
+        self.tool_results[tool_call_id] = full
+        while len(self.tool_results) > MAX_STORED_TOOL_RESULTS:
+            self.tool_results.popitem(last=False)
+        return content
+
+    def close_pending_tool_calls(self, reason: str):
+        """Answer the current turn's tool calls that never got a result.
+
+        The chat API rejects a history where an assistant tool_calls entry is
+        not followed by a tool message per call, so a cancelled or failed turn
+        fills the gaps with reason.
+        """
+        for index in range(len(self.conversation_history) - 1, -1, -1):
+            entry = self.conversation_history[index]
+            if entry["role"] == "user":
+                return
+            if entry["role"] == "assistant" and entry.get("tool_calls"):
+                answered = {later.get("tool_call_id") for later in self.conversation_history[index + 1:]}
+                for tc in entry["tool_calls"]:
+                    if tc.id not in answered:
+                        self.conversation_history.append({"role": "tool", "tool_call_id": tc.id, "content": reason})
+                return
+
+    def close_turn(self, note: str):
+        """Close out a turn that was stopped before the LLM answered.
+
+        A turn that never got past the user's message is dropped from the
+        history so the next turn does not pick it up again; otherwise note
+        stands in for the missing assistant reply.
+        """
+        self.close_pending_tool_calls(note)
+        if self.conversation_history and self.conversation_history[-1]["role"] == "user":
+            self.conversation_history.pop()
+        elif self.conversation_history and self.conversation_history[-1]["role"] == "tool":
+            self.conversation_history.append({"role": "assistant", "content": note})
+
+    def abandon_turn(self, tool_calls_info: List[dict]) -> dict:
+        """Close out a turn that ran past its deadline; returns the frame to send.
+
+        Tools that finished before the deadline are reported as a partial
+        response, otherwise the client gets an error.
+        """
+        self.close_pending_tool_calls("Cancelled: the turn ran out of time before this tool finished.")
+        if not tool_calls_info:
+            self.close_turn("Cancelled: the turn ran out of time.")
+            return {"type": "error", "message": "Sorry, that took too long — please try again."}
+
+        lines = [f"- {info['tool']}: {info['result']}" for info in tool_calls_info]
+        content = "I ran out of time before I could finish. Here is what I got so far:\n" + "\n".join(lines)
+        self.conversation_history.append({"role": "assistant", "content": content})
+        return {"type": "response", "content": content, "tool_calls": tool_calls_info, "partial": True}
+
+    def prefetch_tools(self, tool_calls, tool_args_by_id: Dict[str, dict]) -> Dict[str, asyncio.Task]:
+        """Start read-only tool calls while the user is still approving them.
+        
+        Only used for direct HTTP execution (MCP tools need the VP to run at
+        all) and never for tools with side effects. The results are held back
+        until execute_tool has verified the VP, and discarded otherwise.
+        """
+        if not SPECULATIVE_PREFETCH or TOOL_EXECUTION_MODE == "mcp":
+            return {}
+        prefetches = {}
+        for tc in tool_calls:
+            tool_name = tc.function.name
+            if tool_name in READ_ONLY_TOOLS and tool_name in (self.permissions or self.profile.tools):
+                prefetches[tc.id] = asyncio.create_task(self._prefetch_tool(tool_name, tool_args_by_id[tc.id], tc.id))
+        if prefetches:
+            print(f"[TOOL] Prefetching {len(prefetches)} read-only tool(s) during authorization")
+        return prefetches
+    
+    async def _prefetch_tool(self, tool_name, tool_args, tool_call_id: str):
+        """One speculative run, timed in full (the task shares the turn's timings)"""
+        with turn_timings.measure("tools", tool=tool_name, tool_call_id=tool_call_id, speculative=True):
+            return await self._run_tool(tool_name, tool_args, None, None)
+    
+    async def execute_tool(self, tool_name, tool_args, vp = None, tool_call_id: Optional[str] = None, prefetched: Optional[asyncio.Task] = None):
         """Verify VP (STRICTLY REQUIRED) and execute tool
         
         This method enforces that a Verifiable Presentation (VP) must be created
@@ -484,12 +1240,23 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
         1. Check VP is provided (created via /api/vps/create or /api/vps/agent/:agent_did)
         2. Verify VP via helixid-backend (/api/vps/verify)
         3. Execute tool only if VP is valid
+        
+        prefetched is a speculative run of the same read-only call (see
+        prefetch_tools); its result is only returned once the VP has verified.
         """
         
         print(f"\n{'='*60}")
         print(f"🔐 VP VERIFICATION REQUIRED FOR TOOL: {tool_name}")
         print(f"{'='*60}")
         
+        # 0. The hosted agent's tool manifest bounds what it may ever call
+        if tool_name not in self.profile.tools:
+            error_msg = f"❌ Agent '{self.profile.name}' is not allowed to use '{tool_name}'."
+            print(error_msg)
+            _discard_prefetch(tool_name, prefetched)
+            return error_msg
+        metrics.inc("agent_tool_calls_total", agent=self.profile.agent_id, tool=tool_name)
+        
         # 1. STRICT VP REQUIREMENT CHECK
         if not vp:
             error_msg = (
@@ -497,16 +1264,29 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
                 f"Please ensure /api/vps/create or /api/vps/agent/:agent_did is called before tool execution."
             )
             print(error_msg)
+            _discard_prefetch(tool_name, prefetched)
             return error_msg
 
         print(f"✓ VP provided for tool '{tool_name}'")
         
+        # The VP must be held by this session's agent, not another hosted one
+        holder = vp_holder(vp)
+        if holder != self.profile.did:
+            error_msg = (
+                f"❌ Authorization failed: the VP for '{tool_name}' is held by {holder or 'an unknown holder'}, "
+                f"not by agent '{self.profile.name}' ({self.profile.did})."
+            )
+            print(error_msg)
+            _discard_prefetch(tool_name, prefetched)
+            return error_msg
+        
         # 2. VERIFY VP VIA HELIXID-BACKEND
         # Map tool to required VC type
         tool_type_map = {
             "search_books": "BookOrderingCredential",
             "view_inventory": "BookOrderingCredential",
             "place_order": "BookOrderingCredential",
+            "place_orders": "BookOrderingCredential",
             "check_order_status": "BookOrderingCredential"
         }
         required_type = tool_type_map.get(tool_name)
@@ -514,7 +1294,8 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
         
         # Verify the VP via helixid-backend
         print(f"🔍 Verifying VP via /api/vps/verify...")
-        verification = await verify_agent_vp(vp)
+        with turn_timings.measure("vp_verification", tool=tool_name, tool_call_id=tool_call_id):
+            verification = await verify_agent_vp(vp)
         
         if not verification.get("valid"):
             error_msg = (
@@ -524,6 +1305,7 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
             )
             print(error_msg)
             print(f"{'='*60}\n")
+            _discard_prefetch(tool_name, prefetched)
             return error_msg
         
         print(f"✅ VP verified successfully!")
@@ -532,26 +1314,57 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
         # NEW: Log tool execution to helixid-backend
         # await log_agent_activity(
         #     type="AGENT_TOOL_CALL",
-        #     description=f"Agent '{AGENT_NAME}' executing tool '{tool_name}'",
+        #     description=f"Agent '{self.profile.name}' executing tool '{tool_name}'",
         #     metadata={
         #         "tool": tool_name,
         #         "arguments": tool_args,
         #         "session_id": self.session_id
-        #     }
+        #     },
+        #     agent=self.profile
         # )
         
         # 3. EXECUTE THE ACTUAL TOOL (only after VP verification succeeds)
         print(f"🚀 Executing tool '{tool_name}' with args: {tool_args}")
         
+        # Orders are keyed by the LLM tool call, so re-running the same call never orders twice
+        idempotency_key = f"{self.session_id}:{tool_call_id or uuid.uuid4().hex}"
+        
+        if prefetched is not None:
+            metrics.inc("tool_prefetch_total", tool=tool_name, outcome="used")
+            # Only the part of the call the prefetch did not already hide; the
+            # whole upstream call is the matching speculative=True entry
+            with turn_timings.measure("tools", tool=tool_name, tool_call_id=tool_call_id, prefetched=True):
+                return await prefetched
+        
+        with turn_timings.measure("tools", tool=tool_name, tool_call_id=tool_call_id):
+            return await self._run_tool(tool_name, tool_args, vp, idempotency_key)
+    
+    async def _run_tool(self, tool_name, tool_args, vp, idempotency_key: Optional[str]):
+        """Dispatch a tool call (no authorization checks)"""
+        if TOOL_EXECUTION_MODE == "mcp":
+            return await execute_mcp_tool(tool_name, tool_args, vp, idempotency_key)
+        
         if tool_name == "search_books":
-            return await search_books_tool(tool_args["query"])
+            return await search_books_tool(
+                tool_args["query"],
+                tool_args.get("limit"),
+                tool_args.get("cursor")
+            )
         elif tool_name == "view_inventory":
-            return await view_inventory_tool()
+            return await view_inventory_tool(
+                tool_args.get("limit"),
+                tool_args.get("cursor"),
+                tool_args.get("author"),
+                tool_args.get("in_stock")
+            )
         elif tool_name == "place_order":
             return await place_order_tool(
                 tool_args["book_id"],
-                tool_args.get("quantity", 1)
+                tool_args.get("quantity", 1),
+                idempotency_key
             )
+        elif tool_name == "place_orders":
+            return await place_orders_tool(tool_args["items"], idempotency_key)
         elif tool_name == "check_order_status":
             return await check_order_status_tool(tool_args["order_id"])
         else:
@@ -563,6 +1376,99 @@ Always confirm with the user before placing an order. Be friendly and helpful.""
 # -----------------------------
 sessions: Dict[str, AgentSession] = {}
 
+metrics.describe("session_resumes_total", "Reconnects by whether a resumption token let them skip verification")
+
+
+def _collect_agent_sessions():
+    counts = {agent_id: 0 for agent_id in agent_registry.profiles}
+    for agent in sessions.values():
+        counts[agent.profile.agent_id] += 1
+    for agent_id, count in counts.items():
+        metrics.set_gauge("agent_sessions", count, agent=agent_id)
+
+
+metrics.register_collector(_collect_agent_sessions)
+
+
+def _attach_session(session_id: str, agent: AgentSession, websocket: WebSocket):
+    agent.websocket = websocket
+    agent.detached_at = None
+    sessions[session_id] = agent
+
+
+def _may_replace_session(session_id: str, user_did: Optional[str]) -> bool:
+    """Whether a fresh init by user_did may take over session_id.
+
+    Only the verified user who owns a live session can replace it; anyone
+    else (including anonymous inits) needs that session's resumption token.
+    """
+    existing = sessions.get(session_id)
+    return existing is None or (existing.user_did is not None and existing.user_did == user_did)
+
+
+async def _take_over_session(session_id: str):
+    """Close the connection still serving session_id before another one attaches.
+
+    Otherwise both sockets would run turns on one conversation history.
+    """
+    previous = sessions.get(session_id)
+    if previous is None or previous.websocket is None:
+        return
+    print(f"Session {session_id}: taken over by a new connection")
+    if previous.connection is not None:
+        await previous.connection.take_over()
+    else:  # still initialising
+        try:
+            await previous.websocket.close(code=4000, reason="Session taken over")
+        except Exception:
+            pass
+    previous.websocket = None
+
+
+def _detach_session(session_id: str, websocket: WebSocket):
+    """Keep a disconnected session around so a reconnect can resume it"""
+    agent = sessions.get(session_id)
+    if agent is None or agent.websocket is not websocket:
+        return  # never attached, or already taken over by a newer connection
+    agent.websocket = None
+    agent.detached_at = time.monotonic()
+    asyncio.get_running_loop().call_later(
+        resume_tokens.RESUME_TOKEN_TTL_SECONDS, _expire_session, session_id, agent, agent.detached_at
+    )
+
+
+def _expire_session(session_id: str, agent: AgentSession, detached_at: float):
+    # Still the same disconnect: not resumed (and detached again) in the meantime
+    if sessions.get(session_id) is agent and agent.detached_at == detached_at:
+        del sessions[session_id]
+        print(f"Session {session_id} expired without a reconnect")
+
+
+async def _resolved(value):
+    return value
+
+
+# -----------------------------
+# Graceful shutdown
+# -----------------------------
+# Set by the first SIGTERM: no new sessions or turns, running turns may finish
+draining = False
+_turn_tasks: Set[asyncio.Task] = set()
+
+
+async def drain_turns(timeout: float):
+    """Stop taking sessions and messages, then wait up to timeout for running turns"""
+    global draining
+    draining = True
+    if _turn_tasks:
+        print(f"[SHUTDOWN] Waiting up to {timeout:.0f}s for {len(_turn_tasks)} running turn(s)")
+        await asyncio.wait(set(_turn_tasks), timeout=timeout)
+    if _turn_tasks:
+        print(f"[SHUTDOWN] {len(_turn_tasks)} turn(s) still running — closing anyway")
+
+
+DRAINING_MESSAGE = "The server is restarting — please reconnect in a moment."
+
 
 # -----------------------------
 # API Endpoints
@@ -573,29 +1479,408 @@ async def root():
         "message": "BookOrderer AI Agent API (Azure OpenAI)",
         "status": "running",
         "version": "1.0.0",
-        "bookstore_enabled": True
+        "bookstore_enabled": True,
+        "agents": [
+            {"id": profile.agent_id, "did": profile.did, "name": profile.name, "tools": profile.tools}
+            for profile in agent_registry.profiles.values()
+        ]
     }
 
 
+@app.get("/sessions/{session_id}/tool-results/{tool_call_id}")
+async def get_tool_result(session_id: str, tool_call_id: str, authorization: Optional[str] = Header(None)):
+    """Full (unbudgeted) result of a recent tool call in an active session.
+
+    Requires "Authorization: Bearer <results_token>" from the session's
+    `connected` frame; unknown sessions get the same 401 as a bad token.
+    """
+    agent = sessions.get(session_id)
+    scheme, _, token = (authorization or "").partition(" ")
+    if not agent or scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), agent.results_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing session token", headers={"WWW-Authenticate": "Bearer"})
+    if tool_call_id not in agent.tool_results:
+        raise HTTPException(status_code=404, detail="Tool result not found")
+    return {"tool_call_id": tool_call_id, "result": agent.tool_results[tool_call_id]}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus-format metrics (circuit breakers, upstream latency, ...)"""
+    return metrics.render()
+
+
 @app.get("/health")
 async def health():
+    if TOOL_EXECUTION_MODE == "mcp":
+        return {"status": "healthy", "mcp": bookstore_mcp.status()}
     return {"status": "healthy"}
 
 
 # -----------------------------
 # WebSocket Chat Endpoint
 # -----------------------------
+async def send_frame(websocket: WebSocket, frame: dict):
+    """Send one protocol frame as a JSON text message"""
+    await websocket.send_text(json_codec.dumps(frame))
+
+
+async def receive_frame(websocket: WebSocket) -> dict:
+    """Receive one JSON text message from the client"""
+    return json_codec.loads(await websocket.receive_text())
+
+
+CONNECTED_TOOLS = [
+    {"name": "search_books", "description": "Search for books by title or author"},
+    {"name": "view_inventory", "description": "View full inventory"},
+    {"name": "place_order", "description": "Place an order for a book"},
+    {"name": "place_orders", "description": "Place orders for several books at once"},
+    {"name": "check_order_status", "description": "Check order status"}
+]
+
+
+def connected_frame(agent: AgentSession, resumed: bool = False) -> dict:
+    """The `connected` message, with a fresh resumption token for the next reconnect.
+
+    Issuing it invalidates every earlier token for the session.
+    """
+    agent.resume_nonce = resume_tokens.new_nonce()
+    return {
+        "type": "connected",
+        "message": "Reconnected to bookstore!" if resumed else "Connected to bookstore!",
+        "user": agent.user_did,
+        "agent_id": agent.profile.agent_id,
+        "agent_did": agent.profile.did,
+        "agent_name": agent.profile.name,
+        "agent_permissions": agent.permissions,
+        "agent_key":"1234",
+        "tools": [tool for tool in CONNECTED_TOOLS if tool["name"] in agent.profile.tools],
+        "resumed": resumed,
+        "resume_token": resume_tokens.issue(agent.session_id, agent.user_did, agent.resume_nonce),
+        "resume_token_ttl": resume_tokens.RESUME_TOKEN_TTL_SECONDS,
+        "results_token": agent.results_token
+    }
+
+
+class ChatConnection:
+    """One chat socket, split into a reader task and a turn worker.
+
+    The reader handles every incoming frame as it arrives: messages are
+    queued for the worker, `cancel` aborts the running turn and
+    `tool_auth_response` frames are routed to the turn waiting for those
+    tool call ids. Anything else is logged and ignored, so a stray frame
+    no longer breaks a turn. The worker runs one turn at a time.
+    """
+
+    def __init__(self, websocket: WebSocket, agent: AgentSession):
+        self.websocket = websocket
+        self.agent = agent
+        self.messages: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUED_MESSAGES)
+        self.turn: Optional[asyncio.Task] = None
+        self._auth_waiters: Dict[str, asyncio.Future] = {}  # tool_call_id -> VPs of its auth request
+        self._send_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self.taken_over = False
+
+    async def send(self, frame: dict):
+        async with self._send_lock:
+            await send_frame(self.websocket, frame)
+
+    async def wait_for_auth(self, tool_call_ids: List[str]) -> dict:
+        """Wait for the tool_auth_response covering these tool calls; returns id -> VP"""
+        future = asyncio.get_running_loop().create_future()
+        for tool_call_id in tool_call_ids:
+            self._auth_waiters[tool_call_id] = future
+        try:
+            return await future
+        finally:
+            for tool_call_id in tool_call_ids:
+                self._auth_waiters.pop(tool_call_id, None)
+
+    def _route_auth(self, frame: dict):
+        vps = frame.get("vps") or {}
+        waiters = {id(f): f for key, f in self._auth_waiters.items() if key in vps}
+        if not waiters:
+            print(f"[CHAT] Ignoring tool_auth_response for unknown tool calls: {list(vps)}")
+            return
+        for future in waiters.values():
+            if not future.done():
+                future.set_result(vps)
+
+    async def read(self):
+        """Dispatch incoming frames until the client disconnects"""
+        while True:
+            frame = await receive_frame(self.websocket)
+            kind = frame.get("type")
+            if kind == "message":
+                if not frame.get("content"):
+                    continue
+                if draining:
+                    await self.send({"type": "error", "message": DRAINING_MESSAGE})
+                    continue
+                try:
+                    self.messages.put_nowait(frame["content"])
+                except asyncio.QueueFull:
+                    await self.send({"type": "error", "message": "Too many messages waiting — please wait for the current reply."})
+                    continue
+                if self.turn is not None:
+                    await self.send({"type": "status", "message": f"Queued ({self.messages.qsize()} waiting)"})
+            elif kind == "cancel":
+                if self.turn is not None and not self.turn.done():
+                    print(f"[CHAT] Cancel requested by client")
+                    self.turn.cancel()
+            elif kind == "tool_auth_response":
+                self._route_auth(frame)
+            else:
+                print(f"[CHAT] Ignoring unexpected frame type: {kind!r}")
+
+    async def work(self):
+        """Run queued messages one turn at a time"""
+        while True:
+            user_message = await self.messages.get()
+            if draining:  # queued before the drain started
+                await self.send({"type": "error", "message": DRAINING_MESSAGE})
+                continue
+            await self.send({"type": "typing", "message": "Agent is thinking..."})
+            await self._run_turn(user_message)
+
+    async def _run_turn(self, user_message: str):
+        tool_calls_info: List[dict] = []
+        with deadline.deadline_scope(TURN_DEADLINE_SECONDS), turn_timings.timings_scope(self.agent.timings_enabled) as timings:
+            self.turn = asyncio.create_task(asyncio.wait_for(
+                run_turn(self, user_message, tool_calls_info),
+                timeout=TURN_DEADLINE_SECONDS
+            ))
+        turn = self.turn
+        _turn_tasks.add(turn)
+        turn.add_done_callback(_turn_tasks.discard)
+        try:
+            await asyncio.wait({turn})
+        finally:
+            self.turn = None
+            if not turn.done():  # the worker itself is being cancelled (socket closed)
+                turn.cancel()
+
+        agent_id = self.agent.profile.agent_id
+        if turn.cancelled():
+            metrics.inc("agent_turns_total", agent=agent_id, outcome="cancelled")
+            print(f"[CHAT] Turn cancelled by client — outstanding work cancelled")
+            self.agent.close_turn("Cancelled by the user.")
+            await self.send({"type": "cancelled", "message": "Stopped.", "tool_calls": tool_calls_info})
+            return
+
+        error = turn.exception()
+        if error is None:
+            metrics.inc("agent_turns_total", agent=agent_id, outcome="ok")
+            frame = turn.result()
+            if timings is not None:
+                frame["timings"] = timings.summary()
+            await self.send(frame)
+        elif isinstance(error, LLMOverloaded):
+            metrics.inc("agent_turns_total", agent=agent_id, outcome="shed")
+            print(f"[CHAT] Turn shed: {error}")
+            self.agent.close_turn("Not answered: the assistant was overloaded.")
+            await self.send({
+                "type": "error",
+                "message": "The assistant is busy right now — please try again in a moment.",
+                "retry_after": round(error.retry_after, 1)
+            })
+        elif isinstance(error, (asyncio.TimeoutError, deadline.DeadlineExceeded)):
+            metrics.inc("agent_turns_total", agent=agent_id, outcome="timeout")
+            print(f"[CHAT] Turn exceeded its {TURN_DEADLINE_SECONDS:.0f}s deadline — outstanding work cancelled")
+            frame = self.agent.abandon_turn(tool_calls_info)
+            if timings is not None and frame["type"] == "response":
+                frame["timings"] = timings.summary()
+            await self.send(frame)
+        else:
+            metrics.inc("agent_turns_total", agent=agent_id, outcome="error")
+            print(f"Error in chat loop: {error}")
+            self.agent.close_pending_tool_calls(f"Error: {str(error)}")
+            await self.send({"type": "error", "message": f"Error: {str(error)}"})
+
+    async def take_over(self):
+        """Give the session up to a newer connection: stop this one and close it (4000)"""
+        self.taken_over = True
+        turn = self.turn
+        # Close first: once its tasks stop, serve() returns and ends the handler
+        try:
+            await self.websocket.close(code=4000, reason="Session taken over")
+        except Exception:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        if turn is not None:
+            turn.cancel()
+        await asyncio.gather(*self._tasks, *([turn] if turn is not None else []), return_exceptions=True)
+        if turn is not None:
+            self.agent.close_turn("Interrupted: the session was resumed on another connection.")
+
+    async def serve(self):
+        """Run reader and worker until one of them stops; re-raises its error"""
+        self._tasks = tasks = {asyncio.create_task(self.read()), asyncio.create_task(self.work())}
+        self.agent.connection = self
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.agent.connection is self:
+                self.agent.connection = None
+        if self.taken_over:
+            return
+        for task in done:
+            task.result()
+
+
+async def run_turn(conn: "ChatConnection", user_message: str, tool_calls_info: List[dict]) -> dict:
+    """Run one chat turn and return the frame to send back.
+
+    Runs under the turn deadline; tool results are appended to
+    tool_calls_info as they complete so a timed-out or cancelled turn can
+    still report them.
+    """
+    agent = conn.agent
+    prefetches: Dict[str, asyncio.Task] = {}  # tool_call_id -> speculative read-only run
+    started_at = time.monotonic()
+    tokens_before = agent.llm_tokens_used
+    reply = None  # final text when it does not come from the LLM
+    try:
+        # Loop until we have a final text response (handle multiple rounds of tool calls if needed)
+        print(f"\n[CHAT] User message received (len={len(user_message or '')})")
+        current_message = await agent.get_llm_response(user_message)
+        tool_round = 0
+        while current_message.tool_calls:
+            tool_round += 1
+            print(f"\n[CHAT] Tool round #{tool_round} — LLM requested {len(current_message.tool_calls)} tool(s): {[tc.function.name for tc in current_message.tool_calls]}")
+            # Arguments are parsed once and reused for the auth request and execution
+            tool_args_by_id = {tc.id: json_codec.loads(tc.function.arguments) for tc in current_message.tool_calls}
+        
+            # 1. Request Authorization/VP for ALL tool calls in this turn
+            tool_auth_requests = []
+            tool_type_map = {
+                "search_books": "BookOrderingCredential",
+                "view_inventory": "BookOrderingCredential",
+                "place_order": "BookOrderingCredential",
+                "place_orders": "BookOrderingCredential",
+                "check_order_status": "BookOrderingCredential"
+            }
+    
+            for tc in current_message.tool_calls:
+                tool_auth_requests.append({
+                    "id": tc.id,
+                    "tool": tc.function.name,
+                    "params": tool_args_by_id[tc.id],
+                    "required_vc_type": tool_type_map.get(tc.function.name, "AgentPermissionCredential")
+                })
+    
+            print(f"[CHAT] Sending tool_auth_request to frontend ({len(tool_auth_requests)} requests)")
+            auth_request = {
+                "type": "tool_auth_request",
+                "requests": tool_auth_requests
+            }
+            timings = turn_timings.current()
+            if timings is not None:
+                auth_request["timings"] = timings.summary()
+            await conn.send(auth_request)
+            prefetches.update(agent.prefetch_tools(current_message.tool_calls, tool_args_by_id))
+    
+            # 2. Wait for UI to respond with VPs
+            print(f"[CHAT] Waiting for tool_auth_response from frontend...")
+            with turn_timings.measure("vp_wait", round=tool_round):
+                vps = await conn.wait_for_auth([tc.id for tc in current_message.tool_calls]) # id -> vp mapping
+            print(f"[CHAT] Received tool_auth_response — VPs count: {len(vps)}")
+    
+            # 3. Execute tools with VPs
+            self_message_entry = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": current_message.tool_calls
+            }
+            agent.conversation_history.append(self_message_entry)
+    
+            round_results = []  # (tool, result) for the fast-path templates
+            for tc in current_message.tool_calls:
+                tool_name = tc.function.name
+                tool_args = tool_args_by_id[tc.id]
+                vp = vps.get(tc.id)
+    
+                result = agent.encode_tool_result(
+                    tc.id, tool_name, await agent.execute_tool(tool_name, tool_args, vp, tc.id, prefetches.pop(tc.id, None))
+                )
+    
+                agent.conversation_history.append({
+                    "role": "tool",
+                    "tool_call_id": tc.id,
+                    "content": result
+                })
+    
+                tool_calls_info.append({
+                    "tool": tool_name,
+                    "params": tool_args,
+                    "result": result[:300]
+                })
+                round_results.append((tool_name, result))
+    
+            # 4. Get next response — force text-only so we don't loop another auth round.
+            # Rounds of fast-path tools may answer from a template or a faster deployment
+            arm = fast_path.choose_arm() if fast_path.eligible([tool for tool, _ in round_results]) else None
+            replied_at = time.monotonic()
+            if arm == "fast_path":
+                reply = fast_path.template_reply(round_results)
+            if reply is not None:
+                method = "template"
+                current_message = None
+                print(f"[CHAT] Tool execution done. Fast path: replying from template")
+            elif arm == "fast_path" and AZURE_SUMMARY_DEPLOYMENT:
+                method = "summary"
+                print(f"[CHAT] Tool execution done. Fast path: summarising on {AZURE_SUMMARY_DEPLOYMENT}...")
+                current_message = await agent.get_llm_response(allow_tools=False, deployment=AZURE_SUMMARY_DEPLOYMENT)
+            else:
+                method = "llm"
+                print(f"[CHAT] Tool execution done. Getting final LLM response (allow_tools=False)...")
+                current_message = await agent.get_llm_response(allow_tools=False)
+            if arm is not None:
+                finished_at = time.monotonic()
+                fast_path.record(arm, method, finished_at - replied_at, finished_at - started_at, agent.llm_tokens_used - tokens_before)
+            # Force single tool round: exit so we never send a second tool_auth_request
+            if getattr(current_message, "tool_calls", None):
+                print(f"[CHAT] WARN: LLM still returned {len(current_message.tool_calls)} tool_calls — single round only, exiting loop")
+            break
+    
+        # Final text response
+        final_content = reply or current_message.content or "Done."
+        print(f"[CHAT] Sending final response to frontend (content len={len(final_content)})")
+        agent.conversation_history.append({
+            "role": "assistant",
+            "content": final_content
+        })
+    
+        return {
+            "type": "response",
+            "content": final_content,
+            "tool_calls": [] # We don't need to send tool_calls info here as UI already has it from the interactive flow
+        }
+    finally:
+        # Speculative runs that were never claimed (cancelled turn, unused call)
+        for task in prefetches.values():
+            task.cancel()
+
+
 @app.websocket("/ws/chat/{session_id}")
 async def websocket_chat(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for real-time chat"""
     await websocket.accept()
+    if draining:
+        await send_frame(websocket, {"type": "error", "message": DRAINING_MESSAGE})
+        await websocket.close(code=1012)  # service restart
+        return
     
     try:
         # Wait for initialization message
-        init_msg = await websocket.receive_json()
+        init_msg = await receive_frame(websocket)
         
         if init_msg.get("type") != "init":
-            await websocket.send_json({
+            await send_frame(websocket, {
                 "type": "error",
                 "message": "First message must be of type 'init'"
             })
@@ -608,197 +1893,134 @@ async def websocket_chat(websocket: WebSocket, session_id: str):
         signature = init_msg.get("signature")
         public_key_override = init_msg.get("public_key")  # Optional: for testing
         agent_vp = init_msg.get("agent_vp")
+        resume_token = init_msg.get("resume_token")
         
-        # Verify user authentication (REAL signature verification)
-        if user_did and challenge and signature:
-            # If public_key is provided in init message, use it (for testing)
-            # Otherwise, verify_user_signature will fetch from database
-            if public_key_override:
-                user_auth = await verify_user_signature_with_key(user_did, challenge, signature, public_key_override)
-            else:
-                user_auth = await verify_user_signature(user_did, challenge, signature)
+        # Which hosted agent this session talks to (the default one if not named)
+        profile = agent_registry.select(init_msg.get("agent_id"), init_msg.get("agent_did"))
+        if profile is None:
+            await send_frame(websocket, {
+                "type": "error",
+                "message": f"Unknown agent: {init_msg.get('agent_id') or init_msg.get('agent_did')}"
+            })
+            await websocket.close()
+            return
+        
+        # Fast path: a valid resumption token reattaches to the session kept
+        # after the last disconnect, without verifying everything again
+        agent = sessions.get(session_id)
+        claims = None
+        if resume_token and agent is not None:
+            within_ttl = agent.detached_at is None or time.monotonic() - agent.detached_at <= resume_tokens.RESUME_TOKEN_TTL_SECONDS
+            claims = resume_tokens.verify(resume_token, session_id, agent.resume_nonce) if within_ttl else None
+        if claims and claims.get("did") == agent.user_did and agent.profile is profile:
+            agent.resume_nonce = None  # single use; connected_frame issues the next token
+            metrics.inc("session_resumes_total", outcome="resumed")
+            if "timings" in init_msg:
+                agent.timings_enabled = bool(init_msg["timings"])
+            await _take_over_session(session_id)
+            _attach_session(session_id, agent, websocket)
+            print(f"Session {session_id}: resumed by {agent.user_did or 'anonymous'}")
+            await send_frame(websocket, connected_frame(agent, resumed=True))
+        
+        else:
+            if resume_token:
+                metrics.inc("session_resumes_total", outcome="rejected")
+                print(f"Session {session_id}: resumption token rejected — full verification")
             
-            if not user_auth["valid"]:
-                await websocket.send_json({
+            # The agent VP must belong to the agent this session picked
+            if agent_vp and vp_holder(agent_vp) != profile.did:
+                await send_frame(websocket, {
                     "type": "error",
-                    "message": f"User authentication failed: {user_auth.get('error', 'Invalid signature')}"
+                    "message": f"Agent VP is not held by agent '{profile.agent_id}' ({profile.did})"
                 })
                 await websocket.close()
                 return
-        else:
-            # For now, allow without user auth (will be required in Phase 4)
-            user_auth = {"valid": False, "user_did": None, "user_id": None}
-        
-        # Verify agent VP (if provided)
-        agent_permissions = ["search_books", "place_order", "view_inventory", "check_order_status"]  # Default
-        if agent_vp:
-            vp_result = await verify_agent_vp(agent_vp)
-            if not vp_result["valid"]:
-                await websocket.send_json({
+            
+            # Verify user authentication (REAL signature verification) and the
+            # agent VP; the checks are independent, so they run concurrently
+            if user_did and challenge and signature:
+                # If public_key is provided in init message, use it (for testing)
+                # Otherwise, verify_user_signature will fetch from database
+                if public_key_override:
+                    user_check = verify_user_signature_with_key(user_did, challenge, signature, public_key_override)
+                else:
+                    user_check = verify_user_signature(user_did, challenge, signature)
+            else:
+                # For now, allow without user auth (will be required in Phase 4)
+                user_check = _resolved({"valid": False, "user_did": None, "user_id": None, "anonymous": True})
+            vp_check = verify_agent_vp(agent_vp) if agent_vp else _resolved(None)
+            user_auth, vp_result = await asyncio.gather(user_check, vp_check)
+            
+            if not user_auth["valid"] and not user_auth.get("anonymous"):
+                await send_frame(websocket, {
                     "type": "error",
-                    "message": f"Agent VP verification failed: {vp_result.get('error', 'Invalid VP')}"
+                    "message": f"User authentication failed: {user_auth.get('error', 'Invalid signature')}"
                 })
                 await websocket.close()
                 return
-            agent_permissions = vp_result.get("permissions", agent_permissions)
-        
-        # Use hardcoded Azure API key
-        api_key = AZURE_API_KEY
-        print(f"Session {session_id}: User {user_auth.get('user_did', 'anonymous')} authenticated")
-        
-        # Create agent session
-        try:
-            agent = AgentSession(api_key, session_id)
-            agent.permissions = agent_permissions
-            agent.user_id = user_auth.get("user_id")
-            agent.user_did = user_auth.get("user_did")
-            sessions[session_id] = agent
             
-            await websocket.send_json({
-                "type": "status",
-                "message": "Agent initialized successfully!"
-            })
-            
-            # Send connected message with tools
-            connected_message = {
-                "type": "connected",
-                "message": "Connected to bookstore!",
-                "user": user_auth.get("user_did", "anonymous"),
-                "agent_did": AGENT_DID,
-                "agent_permissions": agent_permissions,
-                "agent_key":"1234",
-                "tools": [
-                    {"name": "search_books", "description": "Search for books by title or author"},
-                    {"name": "view_inventory", "description": "View full inventory"},
-                    {"name": "place_order", "description": "Place an order for a book"},
-                    {"name": "check_order_status", "description": "Check order status"}
-                ]
-            }
+            # Agent VP (if provided)
+            agent_permissions = list(profile.tools)  # Default: the agent's whole tool manifest
+            if vp_result is not None:
+                if not vp_result["valid"]:
+                    await send_frame(websocket, {
+                        "type": "error",
+                        "message": f"Agent VP verification failed: {vp_result.get('error', 'Invalid VP')}"
+                    })
+                    await websocket.close()
+                    return
+                agent_permissions = profile.allowed(vp_result.get("permissions", agent_permissions))
             
-            print(f"\n📤 Sending 'connected' message to frontend:")
-            print(f"   agent_did: {AGENT_DID}")
-            print(f"   Full message: {connected_message}\n")
+            # A session id that is still live belongs to its verified user
+            if not _may_replace_session(session_id, user_auth.get("user_did") if user_auth["valid"] else None):
+                print(f"Session {session_id}: init by {user_auth.get('user_did') or 'anonymous'} refused — session is in use")
+                await send_frame(websocket, {
+                    "type": "error",
+                    "message": "Session is in use; resume it with its resumption token or start a new session"
+                })
+                await websocket.close(code=4003, reason="Session in use")
+                return
             
-            await websocket.send_json(connected_message)
+            # Use hardcoded Azure API key
+            api_key = AZURE_API_KEY
+            print(f"Session {session_id}: User {user_auth.get('user_did', 'anonymous')} authenticated (agent '{profile.agent_id}')")
             
-        except Exception as e:
-            await websocket.send_json({
-                "type": "error",
-                "message": f"Failed to initialize agent: {str(e)}"
-            })
-            await websocket.close()
-            return
-        
-        # Chat loop
-        while True:
-            data = await websocket.receive_json()
-            
-            if data.get("type") == "message":
-                user_message = data.get("content")
-                if not user_message: continue
+            # Create agent session
+            try:
+                agent = AgentSession(api_key, session_id, profile)
+                agent.permissions = agent_permissions
+                agent.user_id = user_auth.get("user_id")
+                agent.user_did = user_auth.get("user_did")
+                agent.timings_enabled = bool(init_msg.get("timings"))
+                await _take_over_session(session_id)
+                _attach_session(session_id, agent, websocket)
                 
-                await websocket.send_json({"type": "typing", "message": "Agent is thinking..."})
+                await send_frame(websocket, {
+                    "type": "status",
+                    "message": "Agent initialized successfully!"
+                })
                 
-                try:
-                    # Loop until we have a final text response (handle multiple rounds of tool calls if needed)
-                    print(f"\n[CHAT] User message received (len={len(user_message or '')})")
-                    current_message = await agent.get_llm_response(user_message)
-                    tool_round = 0
-                    while current_message.tool_calls:
-                        tool_round += 1
-                        print(f"\n[CHAT] Tool round #{tool_round} — LLM requested {len(current_message.tool_calls)} tool(s): {[tc.function.name for tc in current_message.tool_calls]}")
-                        # 1. Request Authorization/VP for ALL tool calls in this turn
-                        tool_auth_requests = []
-                        tool_type_map = {
-                            "search_books": "BookOrderingCredential",
-                            "view_inventory": "BookOrderingCredential",
-                            "place_order": "BookOrderingCredential",
-                            "check_order_status": "BookOrderingCredential"
-                        }
-                        
-                        for tc in current_message.tool_calls:
-                            tool_auth_requests.append({
-                                "id": tc.id,
-                                "tool": tc.function.name,
-                                "params": json.loads(tc.function.arguments),
-                                "required_vc_type": tool_type_map.get(tc.function.name, "AgentPermissionCredential")
-                            })
-                        
-                        print(f"[CHAT] Sending tool_auth_request to frontend ({len(tool_auth_requests)} requests)")
-                        await websocket.send_json({
-                            "type": "tool_auth_request",
-                            "requests": tool_auth_requests
-                        })
-                        
-                        # 2. Wait for UI to respond with VPs
-                        print(f"[CHAT] Waiting for tool_auth_response from frontend...")
-                        auth_response = await websocket.receive_json()
-                        if auth_response.get("type") != "tool_auth_response":
-                            raise Exception("Expected tool_auth_response from UI")
-                        
-                        vps = auth_response.get("vps", {}) # id -> vp mapping
-                        print(f"[CHAT] Received tool_auth_response — VPs count: {len(vps)}")
-                        
-                        # 3. Execute tools with VPs
-                        self_message_entry = {
-                            "role": "assistant",
-                            "content": None,
-                            "tool_calls": current_message.tool_calls
-                        }
-                        agent.conversation_history.append(self_message_entry)
-                        
-                        tool_calls_info = []
-                        for tc in current_message.tool_calls:
-                            tool_name = tc.function.name
-                            tool_args = json.loads(tc.function.arguments)
-                            vp = vps.get(tc.id)
-                            
-                            result = await agent.execute_tool(tool_name, tool_args, vp)
-                            
-                            agent.conversation_history.append({
-                                "role": "tool",
-                                "tool_call_id": tc.id,
-                                "content": result
-                            })
-                            
-                            tool_calls_info.append({
-                                "tool": tool_name,
-                                "params": tool_args,
-                                "result": result[:300]
-                            })
-                        
-                        # 4. Get next response from LLM — force text-only so we don't loop another auth round
-                        print(f"[CHAT] Tool execution done. Getting final LLM response (allow_tools=False)...")
-                        current_message = await agent.get_llm_response(allow_tools=False)
-                        # Force single tool round: exit so we never send a second tool_auth_request
-                        if getattr(current_message, "tool_calls", None):
-                            print(f"[CHAT] WARN: LLM still returned {len(current_message.tool_calls)} tool_calls — single round only, exiting loop")
-                        break
-                    
-                    # Final text response
-                    final_content = current_message.content or "Done."
-                    print(f"[CHAT] Sending final response to frontend (content len={len(final_content)})")
-                    agent.conversation_history.append({
-                        "role": "assistant",
-                        "content": final_content
-                    })
-                    
-                    await websocket.send_json({
-                        "type": "response",
-                        "content": final_content,
-                        "tool_calls": [] # We don't need to send tool_calls info here as UI already has it from the interactive flow
-                    })
-                    
-                except Exception as e:
-                    print(f"Error in chat loop: {e}")
-                    try:
-                        await websocket.send_json({"type": "error", "message": f"Error: {str(e)}"})
-                    except Exception:
-                        print("Could not send error to client (connection may be closed)")
+                # Send connected message with tools
+                connected_message = connected_frame(agent)
+                
+                print(f"\n📤 Sending 'connected' message to frontend:")
+                print(f"   agent_did: {profile.did}")
+                print(f"   Full message: {connected_message}\n")
+                
+                await send_frame(websocket, connected_message)
+                
+            except Exception as e:
+                await send_frame(websocket, {
+                    "type": "error",
+                    "message": f"Failed to initialize agent: {str(e)}"
+                })
+                await websocket.close()
+                return
+        
+        # Chat loop: a reader task feeds the turn worker until the socket closes
+        await ChatConnection(websocket, agent).serve()
     
     except WebSocketDisconnect:
-        if session_id in sessions:
-            del sessions[session_id]
         print(f"Client {session_id} disconnected (normal)")
     
     except Exception as e:
@@ -806,31 +2028,138 @@ async def websocket_chat(websocket: WebSocket, session_id: str):
         import traceback
         traceback.print_exc()
         try:
-            await websocket.send_json({
+            await send_frame(websocket, {
                 "type": "error",
                 "message": f"Unexpected error: {str(e)}"
             })
         except Exception:
             print("Could not send error to client (connection may be closed)")
-        finally:
-            if session_id in sessions:
-                del sessions[session_id]
+    
+    finally:
+        # Also on cancellation (e.g. shutdown), so the session can still expire
+        _detach_session(session_id, websocket)
 
 
 # -----------------------------
 # Run Server
 # -----------------------------
+def _profile_imports(top: int = 20):
+    """Report what importing this module costs (python main.py --profile-imports)"""
+    import subprocess
+    
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main, sys; print(' '.join(sorted(sys.modules)))"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(result.returncode)
+    
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative_us), int(self_us), name.strip()))
+    
+    total_us = next((cumulative for cumulative, _, name in timings if name == "main"), 0)
+    print(f"Importing main took {total_us / 1000:.1f} ms. Slowest imports (cumulative):")
+    for cumulative_us, self_us, name in sorted(timings, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+    
+    loaded = set(result.stdout.split())
+    deferred = [name for name in ("openai", "eth_account", "nacl", "mcp") if name not in loaded]
+    print(f"Deferred until first use: {', '.join(deferred) or 'nothing'}")
+
+
+def _startup_benchmark(runs: int = 3):
+    """Time from process start to the first healthy /health (python main.py --startup-benchmark).
+
+    Starts the server runs times on a free port and exits non-zero when the
+    median is over AGENT_STARTUP_BUDGET_MS.
+    """
+    import socket
+    import statistics
+    import subprocess
+    import urllib.request
+    
+    budget_ms = float(os.getenv("AGENT_STARTUP_BUDGET_MS", "1500"))
+    timings_ms = []
+    for _ in range(runs):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [sys.executable, "main.py"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "AGENT_HOST": "127.0.0.1", "AGENT_PORT": str(port)},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                if server.poll() is not None:
+                    print(f"Server exited with code {server.returncode} before /health answered")
+                    sys.exit(1)
+                if time.monotonic() - started > 30:
+                    print("No healthy /health within 30s")
+                    sys.exit(1)
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.01)
+            timings_ms.append((time.monotonic() - started) * 1000)
+        finally:
+            server.terminate()
+            server.wait()
+    
+    median_ms = statistics.median(timings_ms)
+    print(f"Time to first /health: median {median_ms:.0f} ms over {runs} runs "
+          f"({', '.join(f'{t:.0f}' for t in timings_ms)} ms); budget {budget_ms:.0f} ms")
+    if median_ms > budget_ms:
+        print("Startup is over budget")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    import signal
     import uvicorn
 
-    def _exit_gracefully(*_):
-        print("\nShutting down gracefully...")
-        sys.exit(0)
+    class DrainingServer(uvicorn.Server):
+        """On the first SIGINT/SIGTERM, let running chat turns finish first.
+
+        uvicorn closes every WebSocket as soon as it starts shutting down,
+        and each turn runs over one, so the shutdown is held back until
+        drain_turns returns. A second signal shuts down at once.
+        """
+        _loop: Optional[asyncio.AbstractEventLoop] = None
+        _draining = False
+
+        async def startup(self, sockets=None):
+            self._loop = asyncio.get_running_loop()
+            await super().startup(sockets=sockets)
 
-    signal.signal(signal.SIGINT, _exit_gracefully)
-    if hasattr(signal, "SIGTERM"):
-        signal.signal(signal.SIGTERM, _exit_gracefully)
+        def handle_exit(self, sig, frame):
+            if self._draining or self._loop is None:
+                return super().handle_exit(sig, frame)
+            self._draining = True
+            print("\nDraining: no new sessions or messages...")
+            self._loop.call_soon_threadsafe(self._loop.create_task, self._drain_then_exit(sig, frame))
+
+        async def _drain_then_exit(self, sig, frame):
+            await drain_turns(GRACEFUL_SHUTDOWN_SECONDS)
+            super().handle_exit(sig, frame)
+    
+    if "--profile-imports" in sys.argv:
+        _profile_imports()
+        sys.exit(0)
+    if "--startup-benchmark" in sys.argv:
+        _startup_benchmark()
+        sys.exit(0)
 
     print("=" * 60)
     print("📚 BookOrderer AI Agent - Backend Server")
@@ -838,9 +2167,17 @@ if __name__ == "__main__":
     print(f"Azure OpenAI Endpoint: {AZURE_ENDPOINT}")
     print(f"Deployment: {AZURE_DEPLOYMENT}")
     print(f"Bookstore API: {BOOKING_API_URL}")
+    print(f"Agents: {', '.join(f'{p.agent_id} ({p.name})' for p in agent_registry.profiles.values())}")
+    print(f"Tool execution: {TOOL_EXECUTION_MODE}" + (f" ({BOOKSTORE_MCP_URL})" if TOOL_EXECUTION_MODE == "mcp" else ""))
+    print(f"Turn deadline: {TURN_DEADLINE_SECONDS:.0f}s (LLM call timeout {LLM_TIMEOUT_SECONDS:.0f}s)")
+    print(f"Fast path: {', '.join(sorted(fast_path.FAST_PATH_TOOLS)) or 'off'} (A/B ratio {fast_path.FAST_PATH_AB_RATIO:g}"
+          + (f", summaries on {AZURE_SUMMARY_DEPLOYMENT})" if AZURE_SUMMARY_DEPLOYMENT else ")"))
     print("=" * 60)
-    try:
-        uvicorn.run(app, host="0.0.0.0", port=8000)
-    except KeyboardInterrupt:
-        print("\nShutting down gracefully...")
-        sys.exit(0)
\ No newline at end of file
+    # One worker; launcher.py runs several of these behind one port
+    DrainingServer(uvicorn.Config(
+        app,
+        host=os.getenv("AGENT_HOST", "0.0.0.0"),
+        port=int(os.getenv("AGENT_PORT", "8000")),
+        loop=os.getenv("AGENT_LOOP", "auto"),  # uvloop when installed
+        timeout_graceful_shutdown=int(GRACEFUL_SHUTDOWN_SECONDS),
+    )).run()
\ No newline at end of file
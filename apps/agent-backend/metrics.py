@@ -0,0 +1,104 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters, gauges and summaries (count/sum/max) are keyed by name and labels.
+Values that are cheaper to read on demand than to keep up to date (e.g.
+circuit breaker state) are provided by collectors, which run at scrape time.
+
+Shared module: apps/agent-backend/metrics.py is the canonical copy and
+apps/bookstore/mcp_server/metrics.py must stay identical to it. Edit the
+canonical copy, then run apps/agent-backend/sync_shared_modules.py.
+"""
+
+from typing import Callable, Dict, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_types: Dict[str, str] = {}
+_help: Dict[str, str] = {}
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_gauges: Dict[str, Dict[LabelKey, float]] = {}
+_summaries: Dict[str, Dict[LabelKey, List[float]]] = {}  # [count, sum, max]
+_collectors: List[Callable[[], None]] = []
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def describe(name: str, help_text: str):
+    """Attach a HELP line to a metric"""
+    _help[name] = help_text
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """Increment a counter"""
+    _types.setdefault(name, "counter")
+    series = _counters.setdefault(name, {})
+    key = _key(labels)
+    series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a gauge to an absolute value"""
+    _types.setdefault(name, "gauge")
+    _gauges.setdefault(name, {})[_key(labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Record one observation (e.g. a latency in seconds) in a summary"""
+    _types.setdefault(name, "summary")
+    series = _summaries.setdefault(name, {})
+    stats = series.setdefault(_key(labels), [0.0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += value
+    stats[2] = max(stats[2], value)
+
+
+def register_collector(collector: Callable[[], None]):
+    """Run collector before every scrape; it should call set_gauge() etc."""
+    _collectors.append(collector)
+
+
+def _escape(value: str) -> str:
+    """Label value escaping of the text format (backslash, quote, newline)"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in key)
+    return "{" + body + "}"
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format"""
+    for collector in _collectors:
+        collector()
+
+    lines: List[str] = []
+    for name in sorted(_types):
+        kind = _types[name]
+        if name in _help:
+            help_text = _help[name].replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for key, value in _counters[name].items():
+                lines.append(f"{name}{_labels(key)} {_format(value)}")
+        elif kind == "gauge":
+            for key, value in _gauges[name].items():
+                lines.append(f"{name}{_labels(key)} {_format(value)}")
+        else:
+            for key, (count, total, _) in _summaries[name].items():
+                lines.append(f"{name}_count{_labels(key)} {_format(count)}")
+                lines.append(f"{name}_sum{_labels(key)} {_format(total)}")
+            lines.append(f"# TYPE {name}_max gauge")
+            for key, (_, _, maximum) in _summaries[name].items():
+                lines.append(f"{name}_max{_labels(key)} {_format(maximum)}")
+    return "\n".join(lines) + "\n"
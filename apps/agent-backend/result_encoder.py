@@ -0,0 +1,81 @@
+"""
+Compact, budgeted encoding of tool results for the LLM context.
+
+Tool results are stored in the conversation history and resent on every
+turn, so list-style results are rendered as a table with the header written
+once ("id|title|author|price|stock") and cut off at a per-tool token budget.
+Rows that do not fit are summarised in a single overflow line; the full
+result stays available outside the prompt (see AgentSession.tool_results).
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def _cell(value: Any) -> str:
+    # The column separator must not appear inside a value
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+class TableResult:
+    """Rows returned by a list-style tool, encoded when added to the prompt"""
+
+    def __init__(
+        self,
+        columns: Sequence[str],
+        rows: List[dict],
+        empty_message: str,
+        offset: int = 0,
+        next_cursor: Optional[str] = None,
+    ):
+        self.columns = list(columns)
+        self.rows = rows
+        self.empty_message = empty_message
+        self.offset = offset
+        self.next_cursor = next_cursor
+
+    def _line(self, row: dict) -> str:
+        return "|".join(_cell(row.get(column, "")) for column in self.columns)
+
+    def render_full(self) -> str:
+        """Every row, without a budget (kept out of the prompt)"""
+        if not self.rows:
+            return self.empty_message
+        lines = ["|".join(self.columns)] + [self._line(row) for row in self.rows]
+        if self.next_cursor:
+            lines.append(f"More results available — call again with cursor=\"{self.next_cursor}\"")
+        return "\n".join(lines)
+
+    def encode(self, budget_tokens: int) -> Tuple[str, bool]:
+        """Render within budget_tokens; returns (text, truncated)"""
+        if not self.rows:
+            return self.empty_message, False
+
+        header = "|".join(self.columns)
+        lines = [header]
+        used = estimate_tokens(header)
+        shown = 0
+        for row in self.rows:
+            line = self._line(row)
+            cost = estimate_tokens(line)
+            # Always show at least one row, and leave room for the overflow line
+            if shown and used + cost > budget_tokens - 20:
+                break
+            lines.append(line)
+            used += cost
+            shown += 1
+
+        hidden = len(self.rows) - shown
+        if hidden:
+            more = " (and further pages)" if self.next_cursor else ""
+            lines.append(
+                f"… {hidden} more matches not shown{more} — call again with "
+                f"cursor=\"{self.offset + shown}\" or narrow the query"
+            )
+        elif self.next_cursor:
+            lines.append(f"More results available — call again with cursor=\"{self.next_cursor}\"")
+        return "\n".join(lines), bool(hidden)
@@ -0,0 +1,72 @@
+"""
+Session resumption tokens.
+
+On `connected` the client receives a token bound to its session id, user
+DID and a nonce. Presenting it in the `init` of a reconnect lets the server
+reattach to the session it kept after the disconnect, skipping the user
+signature and agent VP checks the token already stands for.
+
+Validity is decided by the server, not by the token: a session is kept for
+RESUME_TOKEN_TTL_SECONDS after its socket disconnects, and only the token
+carrying the session's current nonce is accepted. Every `connected` frame
+rotates the nonce, so a token works once and a long-lived connection can
+still be resumed.
+
+Tokens are "<payload>.<signature>": base64url JSON signed with HMAC-SHA256.
+Every worker that may receive the reconnect must share RESUME_TOKEN_SECRET;
+without it each process signs with its own random key.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from typing import Optional
+
+RESUME_TOKEN_TTL_SECONDS = float(os.getenv("RESUME_TOKEN_TTL_SECONDS", "600"))
+
+_secret = (os.getenv("RESUME_TOKEN_SECRET") or secrets.token_hex(32)).encode()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret, payload.encode(), hashlib.sha256).digest())
+
+
+def new_nonce() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def issue(session_id: str, user_did: Optional[str], nonce: str) -> str:
+    """Token that lets this user resume this session while nonce is current"""
+    claims = {"sid": session_id, "did": user_did, "nonce": nonce}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify(token: str, session_id: str, nonce: Optional[str]) -> Optional[dict]:
+    """Claims of a valid token for session_id carrying the current nonce, else None"""
+    if not nonce:
+        return None
+    try:
+        payload, signature = token.split(".")
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("sid") != session_id or not hmac.compare_digest(str(claims.get("nonce", "")), nonce):
+        return None
+    return claims
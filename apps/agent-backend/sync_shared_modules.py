@@ -0,0 +1,45 @@
+"""
+Keep the modules shared with the Bookstore MCP server identical.
+
+    python sync_shared_modules.py          # copy the canonical modules over
+    python sync_shared_modules.py --check  # exit 1 if a copy has drifted
+
+The agent backend and the MCP server are deployed separately, each from its
+own directory, so the generic helpers in SHARED_MODULES exist in both. The
+files here are the canonical copies; apps/bookstore/mcp_server holds
+mirrors that must match byte for byte. Anything specific to one app belongs
+in that app's own modules (e.g. mcp_server/upstreams.py), not in these.
+"""
+
+import sys
+from pathlib import Path
+
+SHARED_MODULES = ("json_codec.py", "json_stream.py", "metrics.py", "resilience.py")
+
+CANONICAL_DIR = Path(__file__).resolve().parent
+MIRROR_DIR = CANONICAL_DIR.parent / "bookstore" / "mcp_server"
+
+
+def drifted() -> list:
+    """Shared modules whose mirror differs from the canonical copy"""
+    return [
+        name
+        for name in SHARED_MODULES
+        if (CANONICAL_DIR / name).read_bytes() != (MIRROR_DIR / name).read_bytes()
+    ]
+
+
+def main() -> int:
+    names = drifted()
+    if "--check" in sys.argv[1:]:
+        for name in names:
+            print(f"[sync] {MIRROR_DIR / name} differs from {CANONICAL_DIR / name}")
+        return 1 if names else 0
+    for name in names:
+        (MIRROR_DIR / name).write_bytes((CANONICAL_DIR / name).read_bytes())
+        print(f"[sync] Updated {MIRROR_DIR / name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Per-turn latency breakdown.
+
+Sessions that ask for it in `init` ("timings": true) get a `timings` object
+on their `tool_auth_request` and `response` frames: every LLM call with its
+token usage, the wait for the UI's VPs, each VP verification and each tool
+call. A prefetched tool call has two `tools` entries: the speculative run
+itself (speculative=True) and the part of it the turn still had to wait for
+after verification (prefetched=True). Checkpoints use time.monotonic() and
+only record anything while a TurnTimings is active for the current turn, so
+sessions without timings pay one context-variable lookup per checkpoint.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+SECTIONS = ("llm", "vp_wait", "vp_verification", "tools")
+
+
+class TurnTimings:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.sections: Dict[str, List[dict]] = {section: [] for section in SECTIONS}
+
+    def summary(self) -> dict:
+        """The breakdown so far, in milliseconds"""
+        tokens = {"prompt": 0, "completion": 0, "total": 0}
+        for call in self.sections["llm"]:
+            for kind, count in call.get("tokens", {}).items():
+                tokens[kind] += count
+        return {
+            "total_ms": round((time.monotonic() - self.started_at) * 1000, 1),
+            **{section: list(entries) for section, entries in self.sections.items()},
+            "tokens": tokens,
+        }
+
+
+_current: ContextVar[Optional[TurnTimings]] = ContextVar("turn_timings", default=None)
+
+
+def current() -> Optional[TurnTimings]:
+    return _current.get()
+
+
+@contextmanager
+def timings_scope(enabled: bool):
+    """Collect timings for the enclosed turn (and tasks it spawns) if enabled"""
+    if not enabled:
+        yield None
+        return
+    timings = TurnTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def measure(section: str, **fields):
+    """Time the enclosed block as one entry of section.
+
+    Yields the entry (None when timings are off) so the block can add
+    details such as token counts.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield None
+        return
+    entry = dict(fields)
+    start = time.monotonic()
+    try:
+        yield entry
+    finally:
+        entry["ms"] = round((time.monotonic() - start) * 1000, 1)
+        timings.sections[section].append(entry)
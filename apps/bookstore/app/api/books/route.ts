@@ -1,14 +1,34 @@
 import { NextResponse } from 'next/server';
 import path from 'path';
 import fs from 'fs/promises';
+import { hasQuery, pagedResponse } from '@/lib/query';
 
 const booksFilePath = path.join(process.cwd(), 'data', 'books.json');
 
-export async function GET() {
+type Book = { id: string; title: string; author: string; price: number; stock: number };
+
+const FILTER_PARAMS = ['q', 'author', 'in_stock'];
+
+export async function GET(request: Request) {
   try {
     const data = await fs.readFile(booksFilePath, 'utf8');
-    const books = JSON.parse(data);
-    return NextResponse.json(books);
+    const books: Book[] = JSON.parse(data);
+
+    const { searchParams } = new URL(request.url);
+    if (!hasQuery(searchParams, FILTER_PARAMS)) {
+      return NextResponse.json(books);
+    }
+
+    const q = searchParams.get('q')?.toLowerCase();
+    const author = searchParams.get('author')?.toLowerCase();
+    const inStock = searchParams.get('in_stock');
+    const matches = books.filter(
+      (b) =>
+        (!q || b.title.toLowerCase().includes(q) || b.author.toLowerCase().includes(q)) &&
+        (!author || b.author.toLowerCase().includes(author)) &&
+        (inStock === null || (inStock === 'true') === b.stock > 0)
+    );
+    return pagedResponse(matches, searchParams);
   } catch (error) {
     console.error('Error reading books data:', error);
     return NextResponse.json({ error: 'Failed to fetch books' }, { status: 500 });
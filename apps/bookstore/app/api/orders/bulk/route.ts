@@ -0,0 +1,83 @@
+import { NextResponse } from 'next/server';
+import path from 'path';
+import fs from 'fs/promises';
+
+const ordersFilePath = path.join(process.cwd(), 'data', 'orders.json');
+const booksFilePath = path.join(process.cwd(), 'data', 'books.json');
+
+type Book = { id: string; title: string; author: string; price: number; stock: number };
+type Order = {
+  order_id: number;
+  book_title: string;
+  quantity: number;
+  total_price: number;
+  status: string;
+  created_at: string;
+  ordered_by?: string;
+  idempotency_key?: string;
+};
+type Item = { book_id: string; quantity: number; idempotency_key?: string };
+
+const MAX_ITEMS = 50;
+
+// Place several orders in one request. Every item gets its own result; items
+// whose idempotency_key was already used return the existing order instead
+// of ordering again. Books and orders are each written once for the batch.
+export async function POST(request: Request) {
+  try {
+    const body = await request.json();
+    const { items, ordered_by } = body as { items: Item[]; ordered_by?: string };
+
+    if (!Array.isArray(items) || items.length === 0 || items.length > MAX_ITEMS) {
+      return NextResponse.json({ error: `items must be a list of 1-${MAX_ITEMS} orders` }, { status: 400 });
+    }
+
+    const books: Book[] = JSON.parse(await fs.readFile(booksFilePath, 'utf8'));
+    const orders: Order[] = JSON.parse(await fs.readFile(ordersFilePath, 'utf8'));
+
+    const results = items.map((item) => {
+      const { book_id, quantity, idempotency_key } = item;
+
+      if (idempotency_key) {
+        const existing = orders.find((o) => o.idempotency_key === idempotency_key);
+        if (existing) {
+          return { book_id, status: 'duplicate', order: existing };
+        }
+      }
+      if (!book_id || !quantity || quantity < 1) {
+        return { book_id, status: 'error', error: 'book_id and quantity are required' };
+      }
+      const book = books.find((b) => b.id == book_id);
+      if (!book) {
+        return { book_id, status: 'error', error: 'Book not found' };
+      }
+      if (book.stock < quantity) {
+        return { book_id, status: 'error', error: 'Insufficient stock' };
+      }
+
+      book.stock -= quantity;
+      const order: Order = {
+        order_id: Math.floor(1000 + Math.random() * 9000),
+        book_title: book.title,
+        quantity,
+        total_price: parseFloat((book.price * quantity).toFixed(2)),
+        status: 'Order Placed',
+        created_at: new Date().toISOString(),
+        ordered_by,
+        ...(idempotency_key ? { idempotency_key } : {}),
+      };
+      orders.push(order);
+      return { book_id, status: 'created', order };
+    });
+
+    if (results.some((r) => r.status === 'created')) {
+      await fs.writeFile(booksFilePath, JSON.stringify(books, null, 2), 'utf8');
+      await fs.writeFile(ordersFilePath, JSON.stringify(orders, null, 2), 'utf8');
+    }
+
+    return NextResponse.json({ results });
+  } catch (error) {
+    console.error('Error creating orders:', error);
+    return NextResponse.json({ error: 'Failed to create orders' }, { status: 500 });
+  }
+}
@@ -1,15 +1,45 @@
 import { NextResponse } from 'next/server';
 import path from 'path';
 import fs from 'fs/promises';
+import { hasQuery, pagedResponse } from '@/lib/query';
 
 const ordersFilePath = path.join(process.cwd(), 'data', 'orders.json');
 const booksFilePath = path.join(process.cwd(), 'data', 'books.json');
 
-export async function GET() {
+type Order = {
+  order_id: number;
+  book_title: string;
+  quantity: number;
+  total_price: number;
+  status: string;
+  created_at: string;
+  idempotency_key?: string;
+};
+
+const FILTER_PARAMS = ['order_id', 'status', 'created_after', 'created_before'];
+
+export async function GET(request: Request) {
   try {
     const data = await fs.readFile(ordersFilePath, 'utf8');
-    const orders = JSON.parse(data);
-    return NextResponse.json(orders);
+    const orders: Order[] = JSON.parse(data);
+
+    const { searchParams } = new URL(request.url);
+    if (!hasQuery(searchParams, FILTER_PARAMS)) {
+      return NextResponse.json(orders);
+    }
+
+    const orderId = searchParams.get('order_id');
+    const status = searchParams.get('status')?.toLowerCase();
+    const after = searchParams.get('created_after');
+    const before = searchParams.get('created_before');
+    const matches = orders.filter(
+      (o) =>
+        (!orderId || String(o.order_id) === orderId) &&
+        (!status || o.status.toLowerCase() === status) &&
+        (!after || Date.parse(o.created_at) >= Date.parse(after)) &&
+        (!before || Date.parse(o.created_at) < Date.parse(before))
+    );
+    return pagedResponse(matches, searchParams);
   } catch (error) {
     console.error('Error reading orders data:', error);
     return NextResponse.json({ error: 'Failed to fetch orders' }, { status: 500 });
@@ -20,11 +50,22 @@ export async function POST(request: Request) {
   try {
     const body = await request.json();
     const { book_id, quantity, ordered_by } = body;
+    const idempotencyKey = request.headers.get('Idempotency-Key');
 
     if (!book_id || !quantity || quantity < 1) {
       return NextResponse.json({ error: 'book_title and quantity are required' }, { status: 400 });
     }
 
+    // A retried request returns the order created by the first attempt
+    if (idempotencyKey) {
+      const existing = (JSON.parse(await fs.readFile(ordersFilePath, 'utf8')) as Order[]).find(
+        (o) => o.idempotency_key === idempotencyKey
+      );
+      if (existing) {
+        return NextResponse.json(existing, { status: 200 });
+      }
+    }
+
     // Read books to validate and get price
     const booksData = await fs.readFile(booksFilePath, 'utf8');
     const books: { id: string; title: string; author: string; price: number; stock: number }[] = JSON.parse(booksData);
@@ -53,6 +94,7 @@ export async function POST(request: Request) {
       status: 'Order Placed',
       created_at: new Date().toISOString(),
       ordered_by,
+      ...(idempotencyKey ? { idempotency_key: idempotencyKey } : {}),
     };
 
     orders.push(newOrder);
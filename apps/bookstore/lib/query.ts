@@ -0,0 +1,40 @@
+import { NextResponse } from 'next/server';
+
+// Query parameters understood by the list endpoints. When none are present the
+// endpoints return the full array, exactly as before.
+const PAGE_PARAMS = ['limit', 'cursor', 'fields'];
+
+export const MAX_PAGE_SIZE = 200;
+
+export function hasQuery(searchParams: URLSearchParams, filterParams: string[]): boolean {
+  return [...PAGE_PARAMS, ...filterParams].some((name) => searchParams.has(name));
+}
+
+/**
+ * Paginate and project an already-filtered list.
+ *
+ * The cursor is the opaque offset of the next page. The response carries
+ * `X-Query-Applied` so clients know the filters were applied server-side, and
+ * `X-Next-Cursor` when more results are available.
+ */
+export function pagedResponse<T extends Record<string, unknown>>(
+  items: T[],
+  searchParams: URLSearchParams
+) {
+  const offset = Math.max(0, parseInt(searchParams.get('cursor') || '0', 10) || 0);
+  const requested = parseInt(searchParams.get('limit') || `${MAX_PAGE_SIZE}`, 10) || MAX_PAGE_SIZE;
+  const limit = Math.min(Math.max(1, requested), MAX_PAGE_SIZE);
+
+  let page: Record<string, unknown>[] = items.slice(offset, offset + limit);
+  const fields = searchParams.get('fields');
+  if (fields) {
+    const keep = fields.split(',').map((f) => f.trim()).filter(Boolean);
+    page = page.map((item) => Object.fromEntries(keep.filter((k) => k in item).map((k) => [k, item[k]])));
+  }
+
+  const headers: Record<string, string> = { 'X-Query-Applied': '1' };
+  if (offset + limit < items.length) {
+    headers['X-Next-Cursor'] = String(offset + limit);
+  }
+  return NextResponse.json(page, { headers });
+}
@@ -33,3 +33,56 @@ HELIX_ID_BACKEND_URL: str = os.getenv(
 
 MCP_SERVER_HOST: str = os.getenv("MCP_SERVER_HOST", "0.0.0.0")
 MCP_SERVER_PORT: int = int(os.getenv("MCP_SERVER_PORT", "8001"))
+
+# Transport: "sse" keeps per-connection session state, so it must run as a
+# single worker with sticky routing. "streamable-http" runs stateless (no
+# session affinity) and can be load-balanced and run with multiple workers.
+MCP_TRANSPORT: str = os.getenv("MCP_TRANSPORT", "sse").lower()
+
+# Number of uvicorn worker processes (only honoured for streamable-http)
+MCP_WORKERS: int = int(os.getenv("MCP_WORKERS", "1"))
+
+# Seconds to let in-flight tool calls finish on shutdown before closing
+# connections, so rolling restarts do not drop requests
+MCP_GRACEFUL_SHUTDOWN_TIMEOUT: float = float(
+    os.getenv("MCP_GRACEFUL_SHUTDOWN_TIMEOUT", "30")
+)
+
+# Connection pool size of the per-worker HTTP client used for upstream calls
+HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+# ---------------------------------------------------------------------------
+# List tool paging
+# ---------------------------------------------------------------------------
+
+# Page size used by list_books / get_orders when the caller gives no limit,
+# and the hard cap on any requested limit
+DEFAULT_PAGE_SIZE: int = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+# ---------------------------------------------------------------------------
+# Bulk orders
+# ---------------------------------------------------------------------------
+
+# Maximum number of items accepted by place_orders, and how many single-order
+# requests run at once when the bookstore API has no bulk endpoint
+MAX_BULK_ORDER_ITEMS: int = int(os.getenv("MAX_BULK_ORDER_ITEMS", "50"))
+BULK_ORDER_CONCURRENCY: int = int(os.getenv("BULK_ORDER_CONCURRENCY", "4"))
+
+# ---------------------------------------------------------------------------
+# Upstream resilience
+# ---------------------------------------------------------------------------
+
+# Circuit breaker per upstream: opens once at least BREAKER_MIN_CALLS of the
+# last BREAKER_WINDOW calls exist and BREAKER_FAILURE_RATE of them failed or
+# took longer than BREAKER_SLOW_CALL_SECONDS; probes again after
+# BREAKER_OPEN_SECONDS. While open, VP verification fails closed immediately.
+BREAKER_WINDOW: int = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS: int = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE: float = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS: float = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "3"))
+BREAKER_OPEN_SECONDS: float = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+# Hedged GETs to the bookstore API: start a second attempt if the first has
+# not answered after this many milliseconds. 0 disables hedging.
+HEDGE_DELAY_MS: float = float(os.getenv("HEDGE_DELAY_MS", "0"))
@@ -0,0 +1,42 @@
+"""
+Caller deadlines for tool calls.
+
+The agent-backend runs each chat turn under a deadline and passes what is
+left of it as the ``deadline_ms`` argument to tools that accept one. Tools
+decorated with :func:`bounded` are cancelled once that budget is spent, which
+also cancels their in-flight upstream requests, instead of finishing work
+whose result the caller has already given up on.
+"""
+
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable
+
+# Never cut a tool off before it had a realistic chance to answer
+MIN_DEADLINE_MS = 50
+
+
+def bounded(tool: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Enforce a tool's optional ``deadline_ms`` argument.
+
+    The tool must declare ``deadline_ms: int | None = None`` itself so that
+    it shows up in the schema; the wrapper keeps the tool's signature.
+
+    Raises:
+        ValueError: If the tool did not finish within deadline_ms.
+    """
+
+    @functools.wraps(tool)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        deadline_ms = kwargs.get("deadline_ms")
+        if not deadline_ms:
+            return await tool(*args, **kwargs)
+        try:
+            return await asyncio.wait_for(
+                tool(*args, **kwargs), timeout=max(deadline_ms, MIN_DEADLINE_MS) / 1000
+            )
+        except asyncio.TimeoutError:
+            raise ValueError(f"Deadline exceeded — {tool.__name__} did not finish within {deadline_ms} ms") from None
+
+    return wrapper
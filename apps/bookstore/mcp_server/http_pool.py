@@ -0,0 +1,37 @@
+"""
+Per-worker shared HTTP client.
+
+Every worker process builds its own client on first use, so keep-alive
+connections to the bookstore API and the Helix-ID backend are reused across
+tool calls instead of being re-established for each one. Nothing here is
+shared between workers, which keeps the server stateless behind a load
+balancer.
+"""
+
+import httpx
+
+from config import HTTP_MAX_CONNECTIONS
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return this worker's shared AsyncClient, creating it if needed."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    """Close this worker's client; called from the app lifespan on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,201 @@
+"""
+Incremental parsing of large JSON array responses.
+
+The bookstore API returns lists as one top-level JSON array. Rather than
+materializing the whole body with ``response.json()``, ``iter_json_array``
+decodes one element at a time from the streamed bytes, so memory stays
+bounded by the chunk size plus the largest single element, and callers can
+stop reading as soon as they have what they need.
+
+Shared module: apps/agent-backend/json_stream.py is the canonical copy and
+apps/bookstore/mcp_server/json_stream.py must stay identical to it. Edit the
+canonical copy, then run apps/agent-backend/sync_shared_modules.py.
+"""
+
+import codecs
+import json
+from typing import Any, AsyncIterator
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = set("0123456789+-.eE")
+_OPEN, _FIRST, _VALUE, _SEPARATOR = range(4)
+_decoder = json.JSONDecoder()
+
+
+def _skip(buffer: str, pos: int, chars: str) -> int:
+    while pos < len(buffer) and buffer[pos] in chars:
+        pos += 1
+    return pos
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Yield the elements of a top-level JSON array as they arrive.
+
+    Args:
+        chunks: Raw body chunks, e.g. ``response.aiter_bytes()``.
+
+    Raises:
+        ValueError: If the body is not a JSON array or is malformed.
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    # What may come next: "[", then a value or "]", then "," or "]", then a value
+    expect = _OPEN
+
+    chunk_iter = chunks.__aiter__()
+
+    async def fill() -> bool:
+        """Append the next chunk to the buffer; False once the body is exhausted."""
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        try:
+            chunk = await chunk_iter.__anext__()
+        except StopAsyncIteration:
+            eof = True
+            buffer = buffer[pos:] + utf8.decode(b"", final=True)
+            pos = 0
+            return False
+        # Drop everything already consumed so the buffer never grows with the body
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return True
+
+    while True:
+        pos = _skip(buffer, pos, _WHITESPACE)
+        if pos >= len(buffer):
+            if not await fill():
+                raise ValueError("Unexpected end of JSON array")
+            continue
+
+        char = buffer[pos]
+        if expect == _OPEN:
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            pos += 1
+            expect = _FIRST
+            continue
+        if char == "]" and expect != _VALUE:
+            return
+        if expect == _SEPARATOR:
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in JSON array")
+            pos += 1
+            expect = _VALUE
+            continue
+        if char in ",]":
+            raise ValueError("Expected a value in JSON array")
+
+        try:
+            value, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Element split across chunks: read more and retry
+            if not await fill():
+                raise ValueError("Malformed JSON array") from None
+            continue
+
+        # Accept the value only once the "," or "]" after it has arrived: a
+        # number cut by a chunk boundary ("[12|.5" or "[1.5|e3") decodes as
+        # a shorter, wrong number
+        after = _skip(buffer, end, _WHITESPACE)
+        if after >= len(buffer):
+            if not await fill():
+                raise ValueError("Unexpected end of JSON array")
+            continue
+        if buffer[after] not in ",]":
+            # "[1|e3]": the rest of the buffer may still be part of the number
+            if after == end and set(buffer[end:]) <= _NUMBER_CHARS and await fill():
+                continue
+            raise ValueError("Expected ',' or ']' in JSON array")
+
+        pos = end
+        expect = _SEPARATOR
+        yield value
+
+
+def _peak_rss_mib(mode: str, path: str) -> float:
+    """Parse the listing at path in this process and return the extra peak RSS"""
+    import asyncio
+    import resource
+
+    def rss_kib(field: str) -> int:
+        # VmHWM (peak) and VmRSS (current) on Linux; ru_maxrss elsewhere, which
+        # may still include the parent's peak from before the fork
+        try:
+            with open("/proc/self/status") as status:
+                return next(int(line.split()[1]) for line in status if line.startswith(field + ":"))
+        except (OSError, StopIteration):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async def stream_file():
+        with open(path, "rb") as body:
+            while chunk := body.read(64 * 1024):
+                yield chunk
+
+    async def count_streamed() -> int:
+        return sum([1 async for _ in iter_json_array(stream_file())])
+
+    before = rss_kib("VmRSS")
+    if mode == "stream":
+        count = asyncio.run(count_streamed())
+    else:
+        with open(path, "rb") as body:
+            count = len(json.loads(body.read()))
+    assert count > 0
+    return (rss_kib("VmHWM") - before) / 1024
+
+
+def _memory_benchmark(items: int = 200_000):
+    """Peak RSS of iter_json_array vs json.loads on one large book listing.
+
+        python json_stream.py --memory-benchmark [items]
+
+    Each parser runs in a fresh process on the same file, read in 64 KiB
+    chunks for the streaming parser and in one piece for json.loads.
+    """
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as listing:
+        json.dump(
+            [
+                {
+                    "id": i,
+                    "title": f"Book {i}",
+                    "author": f"Author {i % 997}",
+                    "price": round(5 + (i % 50) * 0.99, 2),
+                    "stock": i % 13,
+                    "description": "A story about " + "books " * 20,
+                }
+                for i in range(items)
+            ],
+            listing,
+        )
+    try:
+        size_mib = os.path.getsize(listing.name) / 2**20
+        print(f"[bench] {items} books, {size_mib:.1f} MiB of JSON")
+        peaks = {}
+        for mode in ("loads", "stream"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--measure", mode, listing.name],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            peaks[mode] = float(output)
+            print(f"[bench] {mode:>6}: peak RSS +{peaks[mode]:.2f} MiB")
+        print(f"[bench] iter_json_array uses {peaks['stream'] / peaks['loads']:.2%} of json.loads' peak")
+    finally:
+        os.unlink(listing.name)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:2] == ["--measure"]:
+        print(_peak_rss_mib(sys.argv[2], sys.argv[3]))
+    elif sys.argv[1:2] == ["--memory-benchmark"]:
+        _memory_benchmark(*[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,156 @@
+"""
+Paging, filtering and field projection for the list tools.
+
+Filters are sent to the bookstore API as query parameters. An API that
+applies them answers with an ``X-Query-Applied`` header (plus
+``X-Next-Cursor`` when more results exist). Otherwise the full array came
+back and the same filters are emulated here, so callers get identical pages
+either way. The emulated path parses the body incrementally and stops
+reading once the page is complete.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable
+
+import json_codec
+import upstreams
+from config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from json_stream import iter_json_array
+
+Predicate = Callable[[dict], bool]
+
+
+def clamp_limit(limit: int | None) -> int:
+    """Apply the default page size and the hard cap to a requested limit."""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def decode_cursor(cursor: str | None) -> int:
+    """Cursors are opaque to callers; internally they are list offsets."""
+    if not cursor:
+        return 0
+    try:
+        offset = int(cursor)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+    if offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return offset
+
+
+def parse_timestamp(value: str | None) -> datetime | None:
+    """Parse an ISO-8601 timestamp; naive values are taken as UTC."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def project(item: dict, fields: list[str] | None) -> dict:
+    """Keep only the requested fields of an item."""
+    if not fields:
+        return item
+    return {key: item[key] for key in fields if key in item}
+
+
+async def paginate(
+    items: AsyncIterator[dict],
+    predicate: Predicate,
+    limit: int,
+    offset: int,
+    fields: list[str] | None,
+    max_matches: int | None = None,
+) -> dict:
+    """
+    Filter, page and project items locally.
+
+    Stops consuming ``items`` as soon as it knows whether a next page exists,
+    or after ``max_matches`` matches when the filter can match at most that
+    many items (e.g. a lookup by id).
+    """
+    page: list[dict] = []
+    next_cursor: str | None = None
+    matched = 0
+    async for item in items:
+        if not predicate(item):
+            continue
+        if matched >= offset + limit:
+            next_cursor = str(offset + limit)
+            break
+        if matched >= offset:
+            page.append(project(item, fields))
+        matched += 1
+        if max_matches is not None and matched >= max_matches:
+            break
+    return {"items": page, "next_cursor": next_cursor}
+
+
+async def fetch_page(
+    url: str,
+    filters: dict[str, Any],
+    predicate: Predicate,
+    limit: int | None,
+    cursor: str | None,
+    fields: list[str] | None,
+    max_matches: int | None = None,
+) -> dict:
+    """
+    Fetch one page of a bookstore list endpoint.
+
+    Args:
+        url: Bookstore list endpoint, e.g. ``.../api/books``.
+        filters: Filter query parameters; ``None`` values are omitted.
+        predicate: Local equivalent of ``filters``, used when the API
+            does not apply them itself.
+        limit: Requested page size (clamped to MAX_PAGE_SIZE).
+        cursor: Cursor returned by the previous page, if any.
+        fields: Fields to keep on each item; all fields when empty.
+        max_matches: Upper bound on how many items the filters can match,
+            letting local emulation stop reading early.
+
+    Returns:
+        ``{"items": [...], "next_cursor": str | None}``.
+    """
+    limit = clamp_limit(limit)
+    offset = decode_cursor(cursor)
+
+    params: dict[str, str] = {}
+    for key, value in filters.items():
+        if value is None:
+            continue
+        params[key] = str(value).lower() if isinstance(value, bool) else str(value)
+    params["limit"] = str(limit)
+    if offset:
+        params["cursor"] = str(offset)
+    if fields:
+        params["fields"] = ",".join(fields)
+
+    async def read_page(client) -> dict:
+        async with client.stream("GET", url, params=params) as response:
+            response.raise_for_status()
+
+            if response.headers.get("x-query-applied"):
+                # Already a bounded page
+                await response.aread()
+                return {
+                    "items": json_codec.loads(response.content),
+                    "next_cursor": response.headers.get("x-next-cursor") or None,
+                }
+
+            # Older bookstore API: it ignored the parameters and is sending
+            # everything, so filter while streaming and hang up once done
+            return await paginate(
+                iter_json_array(response.aiter_bytes()),
+                predicate,
+                limit,
+                offset,
+                fields,
+                max_matches,
+            )
+
+    # Read-only, so a slow first attempt may be hedged
+    return await upstreams.bookstore.run(read_page, hedge=True)
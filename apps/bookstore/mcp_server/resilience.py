@@ -0,0 +1,271 @@
+"""
+Circuit breakers, hedged requests and shared HTTP clients per upstream.
+
+Every upstream (Helix-ID backend, bookstore API) gets one Upstream object
+with its own CircuitBreaker, sending requests through either its own pooled
+httpx client or a shared one from client_factory. Once the recent error or
+slow-call rate crosses the threshold the circuit opens and calls fail
+immediately with CircuitOpenError instead of waiting out their timeouts;
+after a cool-down a limited number of half-open probes decide whether to
+close it again. Callers on the auth path treat CircuitOpenError like any
+other failure, so verification stays fail-closed.
+
+Idempotent GETs can be hedged: if the first attempt has not answered after
+a short delay a second one is started and whichever finishes first wins.
+
+Shared module: apps/agent-backend/resilience.py is the canonical copy and
+apps/bookstore/mcp_server/resilience.py must stay identical to it. Edit the
+canonical copy, then run apps/agent-backend/sync_shared_modules.py.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.describe("upstream_circuit_state", "Circuit breaker state per upstream (0=closed, 1=half-open, 2=open)")
+metrics.describe("upstream_circuit_rejections_total", "Calls rejected without being attempted because the circuit was open")
+metrics.describe("upstream_circuit_transitions_total", "Circuit breaker state changes")
+metrics.describe("upstream_requests_total", "Upstream calls by outcome")
+metrics.describe("upstream_request_seconds", "Upstream call latency")
+metrics.describe("upstream_hedged_requests_total", "Hedge attempts started because the first attempt was slow")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class _Outcome:
+    """Lets a guarded block report a failure that did not raise (e.g. HTTP 5xx)"""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class CircuitBreaker:
+    """Error-rate and latency based circuit breaker over a rolling window of calls"""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: Optional[float] = None,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        is_failure: Callable[[BaseException], bool] = lambda exc: True,
+        is_neutral: Callable[[BaseException], bool] = lambda exc: False,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.is_failure = is_failure
+        self.is_neutral = is_neutral  # errors that say nothing about the upstream (left out of the window)
+
+        self._window: deque = deque(maxlen=window_size)  # True = failed or slow
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+        metrics.register_collector(self._collect)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _collect(self):
+        metrics.set_gauge("upstream_circuit_state", _STATE_VALUES[self.state], upstream=self.name)
+
+    def _transition(self, state: str):
+        print(f"[BREAKER] {self.name}: {self._state} -> {state}")
+        metrics.inc("upstream_circuit_transitions_total", upstream=self.name, to=state)
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._window.clear()
+        self._probes_in_flight = 0
+
+    def _acquire(self) -> bool:
+        """Admit a call or raise CircuitOpenError; returns True for half-open probes"""
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+            self._probes_in_flight += 1
+            return True
+        metrics.inc("upstream_circuit_rejections_total", upstream=self.name)
+        raise CircuitOpenError(f"{self.name} circuit is open — failing fast")
+
+    def _record(self, failed: bool, probe: bool):
+        if probe:
+            self._transition(OPEN if failed else CLOSED)
+            return
+        if self._state != CLOSED:
+            return  # a call admitted before the circuit opened
+        self._window.append(failed)
+        failures = sum(self._window)
+        if len(self._window) >= self.min_calls and failures / len(self._window) >= self.failure_rate:
+            self._transition(OPEN)
+
+    @asynccontextmanager
+    async def guard(self):
+        """Run a block as one call through the breaker"""
+        probe = self._acquire()
+        outcome = _Outcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except asyncio.CancelledError:
+            # Abandoned by the caller: says nothing about the upstream
+            if probe:
+                self._probes_in_flight -= 1
+            raise
+        except BaseException as exc:
+            if self.is_neutral(exc):
+                if probe:
+                    self._probes_in_flight -= 1
+                raise
+            self._record(self.is_failure(exc), probe)
+            raise
+        else:
+            elapsed = time.monotonic() - start
+            slow = self.slow_call_seconds is not None and elapsed > self.slow_call_seconds
+            self._record(outcome.failed or slow, probe)
+
+
+async def hedged(attempt: Callable[[], Awaitable[Any]], delay: float, on_hedge: Optional[Callable[[], None]] = None) -> Any:
+    """Run attempt(); if it has not finished after delay seconds, race a second one.
+
+    Only for idempotent requests. The first successful result wins and the
+    other attempt is cancelled; if both fail the last error is raised.
+    """
+    tasks = {asyncio.ensure_future(attempt())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if on_hedge:
+                on_hedge()
+            tasks.add(asyncio.ensure_future(attempt()))
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    # 4xx responses are the caller's problem, not a sign of an unhealthy upstream
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return True
+
+
+class Upstream:
+    """A remote service: pooled HTTP client + circuit breaker + optional hedging"""
+
+    def __init__(
+        self,
+        name: str,
+        hedge_delay: Optional[float] = None,
+        max_connections: int = 100,
+        client_factory: Optional[Callable[[], httpx.AsyncClient]] = None,
+        **breaker_options,
+    ):
+        self.name = name
+        self.hedge_delay = hedge_delay
+        self.max_connections = max_connections
+        self.client_factory = client_factory  # shared client owned elsewhere (not closed by aclose)
+        self.breaker = CircuitBreaker(name, is_failure=_is_upstream_failure, **breaker_options)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared keep-alive client for this upstream (created on first use)"""
+        if self.client_factory is not None:
+            return self.client_factory()
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _on_hedge(self):
+        metrics.inc("upstream_hedged_requests_total", upstream=self.name)
+
+    async def run(
+        self,
+        fn: Callable[[httpx.AsyncClient], Awaitable[Any]],
+        hedge: bool = False,
+        failed: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Run fn(client) as one guarded call.
+
+        hedge=True is only for idempotent reads. failed(result) marks a
+        result that did not raise as a failure for the breaker.
+        """
+        start = time.monotonic()
+        outcome_label = "error"
+        try:
+            async with self.breaker.guard() as outcome:
+                if hedge and self.hedge_delay:
+                    result = await hedged(lambda: fn(self.client), self.hedge_delay, self._on_hedge)
+                else:
+                    result = await fn(self.client)
+                if failed is not None and failed(result):
+                    outcome.fail()
+                else:
+                    outcome_label = "ok"
+                return result
+        except CircuitOpenError:
+            outcome_label = "rejected"
+            raise
+        finally:
+            metrics.inc("upstream_requests_total", upstream=self.name, outcome=outcome_label)
+            if outcome_label != "rejected":
+                metrics.observe("upstream_request_seconds", time.monotonic() - start, upstream=self.name)
+
+    async def request(self, method: str, url: str, hedge: bool = False, **kwargs) -> httpx.Response:
+        """Send one request through the breaker; 5xx responses count as failures"""
+        return await self.run(
+            lambda client: client.request(method, url, **kwargs),
+            hedge=hedge,
+            failed=lambda response: response.status_code >= 500,
+        )
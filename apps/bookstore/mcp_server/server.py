@@ -9,14 +9,39 @@ Run:
     python server.py
 
 The MCP server starts on SSE transport (default: http://0.0.0.0:8001/sse).
+With MCP_TRANSPORT=streamable-http it serves stateless streamable HTTP
+(http://0.0.0.0:8001/mcp) and can run MCP_WORKERS worker processes.
 """
 
-import httpx
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+
 import uvicorn
 
 from mcp.server.fastmcp import FastMCP
-
-from config import BOOKSTORE_API_BASE_URL, MCP_SERVER_HOST, MCP_SERVER_PORT
+from pydantic import BaseModel, Field
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+import http_pool
+import json_codec
+import metrics
+import upstreams
+from config import (
+    BOOKSTORE_API_BASE_URL,
+    BULK_ORDER_CONCURRENCY,
+    MAX_BULK_ORDER_ITEMS,
+    MCP_GRACEFUL_SHUTDOWN_TIMEOUT,
+    MCP_SERVER_HOST,
+    MCP_SERVER_PORT,
+    MCP_TRANSPORT,
+    MCP_WORKERS,
+)
+from deadline import bounded
+from json_stream import iter_json_array
+from query import fetch_page, parse_timestamp
 from vp_verifier import verify_vp
 
 # ---------------------------------------------------------------------------
@@ -31,6 +56,10 @@ mcp = FastMCP(
         "Pass the VP token you received from the Helix-ID wallet as the "
         "`vp_token` argument to each tool."
     ),
+    # Streamable HTTP: no per-client session state, plain JSON responses,
+    # so any worker behind any load balancer can serve any request
+    stateless_http=MCP_TRANSPORT == "streamable-http",
+    json_response=MCP_TRANSPORT == "streamable-http",
 )
 
 
@@ -46,52 +75,166 @@ async def _require_valid_vp(vp_token: str) -> None:
         raise ValueError(f"Unauthorized — VP verification failed: {reason}")
 
 
+async def _find_book_id(book_title: str) -> str:
+    """Resolve an exact book title to its id, stopping at the first match."""
+
+    async def search(client) -> str | None:
+        async with client.stream("GET", f"{BOOKSTORE_API_BASE_URL}/api/books") as response:
+            response.raise_for_status()
+            async for book in iter_json_array(response.aiter_bytes()):
+                if book["title"].lower() == book_title.lower():
+                    return book["id"]
+        return None
+
+    book_id = await upstreams.bookstore.run(search, hedge=True)
+    if book_id is None:
+        raise ValueError(f"Book not found: {book_title!r}")
+    return book_id
+
+
 # ---------------------------------------------------------------------------
 # Tools
 # ---------------------------------------------------------------------------
 
 
 @mcp.tool()
-async def list_books(vp_token: str) -> list[dict]:
+@bounded
+async def list_books(
+    vp_token: str,
+    limit: int | None = None,
+    cursor: str | None = None,
+    query: str | None = None,
+    author: str | None = None,
+    in_stock: bool | None = None,
+    fields: list[str] | None = None,
+    deadline_ms: int | None = None,
+) -> dict:
     """
-    List all books available in the bookstore with their current stock levels.
+    List books in the bookstore with their current stock levels, one page
+    at a time.
 
     Args:
         vp_token: Verifiable Presentation token for authorization.
+        limit: Maximum number of books to return (default DEFAULT_PAGE_SIZE,
+            capped at MAX_PAGE_SIZE).
+        cursor: The next_cursor of the previous page; omit for the first page.
+        query: Only books whose title or author contains this text.
+        author: Only books whose author contains this text.
+        in_stock: True for books with stock > 0, False for sold-out books.
+        fields: Book fields to return (e.g. ["id", "title"]); all by default.
+        deadline_ms: Optional time budget in milliseconds; the call is
+            abandoned with an error once it is used up.
 
     Returns:
-        A list of book objects with id, title, author, price, and stock.
+        {"items": [...], "next_cursor": str | None}, where items are book
+        objects with id, title, author, price, and stock.
     """
     await _require_valid_vp(vp_token)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.get(f"{BOOKSTORE_API_BASE_URL}/api/books")
-        response.raise_for_status()
-        return response.json()
+    query_lower = query.lower() if query else None
+    author_lower = author.lower() if author else None
+
+    def matches(book: dict) -> bool:
+        if query_lower and not (
+            query_lower in book["title"].lower() or query_lower in book["author"].lower()
+        ):
+            return False
+        if author_lower and author_lower not in book["author"].lower():
+            return False
+        if in_stock is not None and (book["stock"] > 0) != in_stock:
+            return False
+        return True
+
+    return await fetch_page(
+        f"{BOOKSTORE_API_BASE_URL}/api/books",
+        {"q": query, "author": author, "in_stock": in_stock},
+        matches,
+        limit,
+        cursor,
+        fields,
+    )
 
 
 @mcp.tool()
-async def get_orders(vp_token: str) -> list[dict]:
+@bounded
+async def get_orders(
+    vp_token: str,
+    limit: int | None = None,
+    cursor: str | None = None,
+    order_id: int | None = None,
+    status: str | None = None,
+    created_after: str | None = None,
+    created_before: str | None = None,
+    fields: list[str] | None = None,
+    deadline_ms: int | None = None,
+) -> dict:
     """
-    Retrieve all orders that have been placed in the bookstore.
+    Retrieve orders placed in the bookstore, one page at a time.
 
     Args:
         vp_token: Verifiable Presentation token for authorization.
+        limit: Maximum number of orders to return (default DEFAULT_PAGE_SIZE,
+            capped at MAX_PAGE_SIZE).
+        cursor: The next_cursor of the previous page; omit for the first page.
+        order_id: Only the order with this id.
+        status: Only orders with this status (case-insensitive).
+        created_after: ISO-8601 timestamp; only orders created at or after it.
+        created_before: ISO-8601 timestamp; only orders created before it.
+        fields: Order fields to return (e.g. ["order_id", "status"]); all by
+            default.
+        deadline_ms: Optional time budget in milliseconds; the call is
+            abandoned with an error once it is used up.
 
     Returns:
-        A list of order objects with order_id, book_title, quantity,
-        total_price, status, and created_at.
+        {"items": [...], "next_cursor": str | None}, where items are order
+        objects with order_id, book_title, quantity, total_price, status,
+        and created_at.
     """
     await _require_valid_vp(vp_token)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.get(f"{BOOKSTORE_API_BASE_URL}/api/orders")
-        response.raise_for_status()
-        return response.json()
+    status_lower = status.lower() if status else None
+    after = parse_timestamp(created_after)
+    before = parse_timestamp(created_before)
+
+    def matches(order: dict) -> bool:
+        if order_id is not None and int(order["order_id"]) != order_id:
+            return False
+        if status_lower and order["status"].lower() != status_lower:
+            return False
+        if after or before:
+            created = parse_timestamp(order["created_at"])
+            if after and created < after:
+                return False
+            if before and created >= before:
+                return False
+        return True
+
+    return await fetch_page(
+        f"{BOOKSTORE_API_BASE_URL}/api/orders",
+        {
+            "order_id": order_id,
+            "status": status,
+            "created_after": created_after,
+            "created_before": created_before,
+        },
+        matches,
+        limit,
+        cursor,
+        fields,
+        max_matches=1 if order_id is not None else None,
+    )
 
 
 @mcp.tool()
-async def place_order(vp_token: str, book_title: str, quantity: int) -> dict:
+@bounded
+async def place_order(
+    vp_token: str,
+    quantity: int,
+    book_id: str = "",
+    book_title: str = "",
+    idempotency_key: str | None = None,
+    deadline_ms: int | None = None,
+) -> dict:
     """
     Place a new order for a book in the bookstore.
 
@@ -100,8 +243,14 @@ async def place_order(vp_token: str, book_title: str, quantity: int) -> dict:
 
     Args:
         vp_token: Verifiable Presentation token for authorization.
-        book_title: The exact title of the book to order.
         quantity: Number of copies to order (must be >= 1).
+        book_id: The ID of the book to order (preferred).
+        book_title: The exact title of the book to order, used when
+            book_id is not given.
+        idempotency_key: Optional key; retrying with the same key returns
+            the original order instead of ordering again.
+        deadline_ms: Optional time budget in milliseconds; the call is
+            abandoned with an error once it is used up.
 
     Returns:
         The newly created order object with order_id, book_title, quantity,
@@ -109,28 +258,149 @@ async def place_order(vp_token: str, book_title: str, quantity: int) -> dict:
     """
     await _require_valid_vp(vp_token)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(
+    if not book_id:
+        # The bookstore API identifies books by id; resolve the title
+        book_id = await _find_book_id(book_title)
+
+    response = await upstreams.bookstore.request(
+        "POST",
+        f"{BOOKSTORE_API_BASE_URL}/api/orders",
+        json={"book_id": book_id, "quantity": quantity, "ordered_by": "agent"},
+        headers={"Idempotency-Key": idempotency_key} if idempotency_key else None,
+    )
+    response.raise_for_status()
+    return json_codec.loads(response.content)
+
+
+class OrderItem(BaseModel):
+    """One line of a bulk order."""
+
+    book_id: str = Field(description="The ID of the book to order")
+    quantity: int = Field(default=1, ge=1, description="Number of copies")
+
+
+async def _place_single_order(item: dict) -> dict:
+    """Fallback for APIs without /api/orders/bulk: one POST per item."""
+    try:
+        response = await upstreams.bookstore.request(
+            "POST",
             f"{BOOKSTORE_API_BASE_URL}/api/orders",
-            json={"book_title": book_title, "quantity": quantity},
+            json={"book_id": item["book_id"], "quantity": item["quantity"], "ordered_by": "agent"},
+            headers={"Idempotency-Key": item["idempotency_key"]},
         )
+    except Exception as exc:  # noqa: BLE001 — reported per item
+        return {"book_id": item["book_id"], "status": "error", "error": str(exc)}
+    if response.status_code in (200, 201):
+        status = "created" if response.status_code == 201 else "duplicate"
+        return {"book_id": item["book_id"], "status": status, "order": json_codec.loads(response.content)}
+    try:
+        error = json_codec.loads(response.content).get("error", f"HTTP {response.status_code}")
+    except ValueError:
+        error = f"HTTP {response.status_code}"
+    return {"book_id": item["book_id"], "status": "error", "error": error}
+
+
+@mcp.tool()
+@bounded
+async def place_orders(
+    vp_token: str,
+    items: list[OrderItem],
+    idempotency_key: str | None = None,
+    deadline_ms: int | None = None,
+) -> dict:
+    """
+    Place orders for several books in one call.
+
+    Items are submitted to the bookstore in a single request when it supports
+    bulk orders, otherwise as individual orders with bounded concurrency.
+    Each item succeeds or fails on its own.
+
+    Args:
+        vp_token: Verifiable Presentation token for authorization.
+        items: Books to order, each with book_id and quantity.
+        idempotency_key: Optional key for the batch. Retrying with the same
+            key returns the orders already created instead of ordering again
+            (item i uses "<idempotency_key>:<i>").
+        deadline_ms: Optional time budget in milliseconds; the call is
+            abandoned with an error once it is used up.
+
+    Returns:
+        {"results": [...]} with one entry per item, in order: book_id,
+        status ("created", "duplicate" or "error"), and the order object or
+        an error message.
+    """
+    await _require_valid_vp(vp_token)
+
+    if not items or len(items) > MAX_BULK_ORDER_ITEMS:
+        raise ValueError(f"items must contain 1-{MAX_BULK_ORDER_ITEMS} orders")
+
+    batch_key = idempotency_key or uuid.uuid4().hex
+    payload = [
+        {"book_id": item.book_id, "quantity": item.quantity, "idempotency_key": f"{batch_key}:{i}"}
+        for i, item in enumerate(items)
+    ]
+
+    response = await upstreams.bookstore.request(
+        "POST",
+        f"{BOOKSTORE_API_BASE_URL}/api/orders/bulk",
+        json={"items": payload, "ordered_by": "agent"},
+    )
+    if response.status_code not in (404, 405):
         response.raise_for_status()
-        return response.json()
+        return json_codec.loads(response.content)
+
+    # No bulk endpoint: submit items individually, a few at a time
+    semaphore = asyncio.Semaphore(BULK_ORDER_CONCURRENCY)
+
+    async def submit(item: dict) -> dict:
+        async with semaphore:
+            return await _place_single_order(item)
+
+    results = await asyncio.gather(*(submit(item) for item in payload))
+    return {"results": list(results)}
 
 
 # ---------------------------------------------------------------------------
-# Entry point
+# Metrics
+# ---------------------------------------------------------------------------
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus-format metrics of this worker (circuit breakers, upstream latency)."""
+    return PlainTextResponse(metrics.render())
+
+
+# ---------------------------------------------------------------------------
+# ASGI app
 # ---------------------------------------------------------------------------
 
-if __name__ == "__main__":
-    import uvicorn
-    from starlette.middleware.cors import CORSMiddleware
 
-    # For SSE transport, we run the Starlette app using uvicorn
-    app = mcp.sse_app()
+def create_app():
+    """
+    Build the ASGI app for the configured transport.
+
+    Used as a uvicorn factory so that each worker process builds its own app
+    (and its own shared HTTP client) after forking.
+    """
+    if MCP_TRANSPORT == "streamable-http":
+        app = mcp.streamable_http_app()
+    else:
+        app = mcp.sse_app()
+
+    # Close this worker's pooled HTTP client after the MCP lifespan ends
+    inner_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(starlette_app):
+        async with inner_lifespan(starlette_app):
+            yield
+        await http_pool.aclose()
+
+    app.router.lifespan_context = lifespan
 
     # Add CORS middleware to allow the MCP Inspector to connect
-    app = CORSMiddleware(
+    return CORSMiddleware(
         app,
         allow_origins=["*"],
         allow_methods=["*"],
@@ -138,8 +408,29 @@ if __name__ == "__main__":
         expose_headers=["*"],
     )
 
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    workers = MCP_WORKERS
+    if MCP_TRANSPORT != "streamable-http" and workers > 1:
+        # SSE sessions live in the worker that accepted the stream; a message
+        # POSTed to another worker would not find its session
+        print(
+            f"MCP_WORKERS={workers} requires MCP_TRANSPORT=streamable-http; "
+            "running a single SSE worker"
+        )
+        workers = 1
+
+    # On SIGTERM uvicorn stops accepting connections and waits up to
+    # MCP_GRACEFUL_SHUTDOWN_TIMEOUT for in-flight tool calls to complete
     uvicorn.run(
-        app,
+        "server:create_app",
+        factory=True,
         host=MCP_SERVER_HOST,
         port=MCP_SERVER_PORT,
+        workers=workers,
+        timeout_graceful_shutdown=MCP_GRACEFUL_SHUTDOWN_TIMEOUT,
     )
@@ -0,0 +1,32 @@
+"""
+Upstream services of the MCP server.
+
+One Upstream (circuit breaker + hedging, see resilience.py) per remote
+service, all sending requests through the worker's shared client from
+http_pool.
+"""
+
+import http_pool
+from config import (
+    BREAKER_FAILURE_RATE,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_SECONDS,
+    BREAKER_SLOW_CALL_SECONDS,
+    BREAKER_WINDOW,
+    HEDGE_DELAY_MS,
+)
+from resilience import Upstream
+
+_options = dict(
+    hedge_delay=HEDGE_DELAY_MS / 1000 or None,
+    client_factory=http_pool.get_client,
+    window_size=BREAKER_WINDOW,
+    min_calls=BREAKER_MIN_CALLS,
+    failure_rate=BREAKER_FAILURE_RATE,
+    slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+    open_seconds=BREAKER_OPEN_SECONDS,
+)
+
+# One breaker per upstream, per worker process
+helix_id = Upstream("helix_id", **_options)
+bookstore = Upstream("bookstore", **_options)
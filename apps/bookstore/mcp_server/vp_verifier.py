@@ -8,6 +8,9 @@ as invalid and the tool call is blocked.
 
 import httpx
 
+import json_codec
+import resilience
+import upstreams
 from config import HELIX_ID_BACKEND_URL
 
 # Endpoint on the Helix-ID backend that verifies a VP token
@@ -27,17 +30,17 @@ async def verify_vp(vp_token: str) -> tuple[bool, str]:
         - reason: Human-readable explanation; empty string on success.
 
     The function is fail-closed: any error (network, timeout, unexpected
-    response) returns (False, <reason>) — never (True, ...).
+    response, open circuit) returns (False, <reason>) — never (True, ...).
     """
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                _VERIFY_ENDPOINT,
-                json={"vp_token": vp_token},
-            )
+        response = await upstreams.helix_id.request(
+            "POST",
+            _VERIFY_ENDPOINT,
+            json={"vp_token": vp_token},
+        )
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_codec.loads(response.content)
             verified: bool = data.get("verified", False)
             reason: str = data.get("reason", "")
             return verified, reason
@@ -45,6 +48,8 @@ async def verify_vp(vp_token: str) -> tuple[bool, str]:
         # Non-200 responses from the backend count as verification failure
         return False, f"VP verification failed with HTTP {response.status_code}"
 
+    except resilience.CircuitOpenError:
+        return False, "VP verification service unavailable (circuit open)"
     except httpx.ConnectError:
         return False, "VP verification service unavailable (connection refused)"
     except httpx.TimeoutException: